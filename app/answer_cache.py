@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# prep.py rewrites this file whenever the index is rebuilt; caches drop their answers when it changes
+INDEX_VERSION_PATH = os.getenv("INDEX_VERSION_PATH", "/app/index_version")
+
+
+def write_index_version(path=INDEX_VERSION_PATH):
+    """
+    Record that the index changed so semantic caches in running apps invalidate.
+
+    Returns False when the file can't be written, e.g. prep.py run outside the container
+    where /app doesn't exist; a cache that isn't invalidated must not fail ingestion.
+    """
+    tmp_path = path + ".tmp"
+
+    try:
+        with open(tmp_path, "w") as f_out:
+            f_out.write(str(time.time()))
+
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write the index version to {path}, answer caches won't be invalidated: {e}", flush=True)
+
+        return False
+
+    return True
+
+
+def read_index_version(path=INDEX_VERSION_PATH):
+    try:
+        with open(path) as f_in:
+            return f_in.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class SemanticAnswerCache:
+    """
+    Serves stored answers to questions that are near-duplicates of earlier ones.
+
+    Entries are answers judged RELEVANT, keyed by their question's embedding. A lookup
+    returns the closest entry whose cosine similarity reaches `threshold`. Entries expire
+    after `ttl` seconds, the least recently used are evicted beyond `max_size`, and all
+    entries are dropped when the index version file changes. Adding an answer to a question
+    that already has a match updates that entry instead of storing a duplicate.
+    """
+
+    def __init__(self, threshold=0.92, ttl=86400, max_size=1000, version_path=INDEX_VERSION_PATH,
+                 version_check_interval=5.0):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version_path = version_path
+        self.version_check_interval = version_check_interval
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.next_key = 0
+        self.matrix = None
+        self.matrix_keys = []
+        self.index_version = read_index_version(version_path)
+        self.version_checked_at = time.time()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def lookup(self, vector):
+        """Return (entry, similarity) for the best match above the threshold, or None."""
+        query = normalize(vector)
+
+        with self.lock:
+            self._check_index_version()
+            self._expire()
+
+            key, similarity = self._best_match(query)
+
+            if key is None:
+                self.stats['misses'] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+
+            return self.entries[key], similarity
+
+    def add(self, vector, question, answer, model_choice, relevance, explanation):
+        vector = normalize(vector)
+        entry = {
+            'answer': answer,
+            'model_used': model_choice,
+            'relevance': relevance,
+            'relevance_explanation': explanation,
+            'created_at': time.time(),
+        }
+
+        with self.lock:
+            self._check_index_version()
+            self._expire()
+
+            # a near-duplicate would be served the existing entry anyway, so refresh it in place
+            # rather than storing a copy that pushes a distinct answer out of the cache
+            key, _ = self._best_match(vector)
+
+            if key is not None:
+                self.entries[key].update(entry)
+                self.entries.move_to_end(key)
+                return
+
+            self.entries[self.next_key] = {'vector': vector, 'question': question, **entry}
+            self.next_key += 1
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+            self.matrix = None
+
+    def invalidate(self):
+        with self.lock:
+            self._clear()
+            self.stats['invalidations'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'size': len(self.entries)}
+
+    def _best_match(self, query):
+        """Return (key, similarity) of the closest entry at or above the threshold, or (None, None)."""
+        if not self.entries:
+            return None, None
+
+        if self.matrix is None:
+            self.matrix_keys = list(self.entries)
+            self.matrix = np.stack([self.entries[key]['vector'] for key in self.matrix_keys])
+
+        similarities = self.matrix @ query
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+
+        if similarity < self.threshold:
+            return None, None
+
+        return self.matrix_keys[best], similarity
+
+    def _clear(self):
+        self.entries.clear()
+        self.matrix = None
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in self.entries.items() if entry['created_at'] < cutoff]
+
+        for key in expired:
+            del self.entries[key]
+
+        if expired:
+            self.stats['expirations'] += len(expired)
+            self.matrix = None
+
+    def _check_index_version(self):
+        now = time.time()
+
+        if now - self.version_checked_at < self.version_check_interval:
+            return
+
+        self.version_checked_at = now
+        index_version = read_index_version(self.version_path)
+
+        if index_version != self.index_version:
+            self.index_version = index_version
+            self._clear()
+            self.stats['invalidations'] += 1
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm > 0 else vector
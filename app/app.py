@@ -1,24 +1,95 @@
+import io
+import os
 import streamlit as st
 import time
 import uuid
 import matplotlib.pyplot as plt
 
-from assistant import get_answer
+from assistant import AUTO_MODEL, get_answer, get_answer_async, get_answer_stream, get_router, run_async, warm_up
 from db import (
     save_conversation,
     save_feedback,
     get_recent_conversations,
     get_feedback_stats,
+    get_relevance_distribution,
+    get_daily_stats,
+    migrate_db,
+    add_write_listener,
 )
+from relevance_queue import get_relevance_queue
+from tracing import start_metrics_export
+
+# answer questions on the shared asyncio loop instead of blocking this session's thread
+USE_ASYNC_PIPELINE = os.getenv("ASYNC_PIPELINE", "false").lower() == "true"
+
+# show the answer before it is judged; relevance is filled in later by the background queue
+DEFER_RELEVANCE = os.getenv("DEFER_RELEVANCE", "false").lower() == "true"
+
+# write the answer into the page as Claude generates it
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
+
+# seconds dashboard queries are reused across reruns before going back to Postgres
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+
+# load the embedding model and clients when the server starts rather than on the first question
+ASSISTANT_WARMUP = os.getenv("ASSISTANT_WARMUP", "true").lower() == "true"
 
 def print_log(message):
     print(message, flush=True)
 
+@st.cache_resource(show_spinner="Loading the assistant...")
+def warm_up_assistant():
+    # cache_resource runs this once per server process, not once per session
+    warm_up_time = warm_up()
+    print_log(f"Assistant warmed up in {warm_up_time:.2f}s")
+    return warm_up_time
+
+@st.cache_resource
+def seed_router_spend():
+    # the router's daily budget counts what was already spent today before this process started
+    try:
+        spend = sum(float(row["claude_cost"] or 0) for row in get_daily_stats(days=1))
+    except Exception as e:
+        print_log(f"Could not load today's spend for the model router: {e}")
+        return 0.0
+
+    get_router().add_spend(spend)
+    return spend
+
+@st.cache_resource
+def migrate_database():
+    # the entrypoint only runs prep.py once per container, so existing databases are migrated here too
+    try:
+        migrate_db()
+    except Exception as e:
+        print_log(f"Could not migrate the database: {e}")
+    return True
+
+@st.cache_resource
+def watch_dashboard_writes():
+    # cached dashboard queries are dropped once writes reach Postgres, not when they're queued:
+    # with write-behind on that is after the flush, and deferred relevance updates count too
+    add_write_listener(clear_dashboard_cache)
+    return True
+
+@st.cache_resource
+def start_metrics():
+    # one /metrics endpoint or metrics file per server process
+    start_metrics_export()
+    return True
+
 def main():
     print_log("Starting the Hack for LA Contributor Assistant app...")
 
     st.title("Hack for LA Contributor Assistant")
 
+    start_metrics()
+    migrate_database()
+    watch_dashboard_writes()
+
+    if ASSISTANT_WARMUP:
+        warm_up_assistant()
+
     # Session state initialization
     if "conversation_id" not in st.session_state:
         st.session_state.conversation_id = str(uuid.uuid4())
@@ -31,12 +102,15 @@ def main():
 
     print_log(f"Current conversation ID: {st.session_state.conversation_id}")
 
-    # Model selection in the sidebar
+    # Model selection in the sidebar; "auto" routes each question to Haiku or Sonnet
     model_choice = st.sidebar.selectbox(
         "Select a model:",
-        ["claude/3-haiku", "claude/3-5-sonnet"],
+        [AUTO_MODEL, "claude/3-haiku", "claude/3-5-sonnet"],
     )
 
+    if model_choice == AUTO_MODEL:
+        seed_router_spend()
+
     print_log(f"User selected model: {model_choice}")
 
     # Question input and answer display container
@@ -45,39 +119,72 @@ def main():
 
         if user_input:
             print_log(f"User asked: '{user_input}'")
+            print_log(f"Getting answer from assistant using {model_choice} model...")
 
-            with st.spinner("Processing..."):
-                print_log(f"Getting answer from assistant using {model_choice} model...")
+            start_time = time.time()
 
-                start_time = time.time()
-                answer_data = get_answer(user_input, model_choice)
-                end_time = time.time()
+            if STREAM_ANSWERS and not USE_ASYNC_PIPELINE:
+                with st.spinner("Searching the contributing guidelines..."):
+                    answer_chunks, answer_data = get_answer_stream(user_input, model_choice, DEFER_RELEVANCE)
 
-                print_log(f"Answer received in {end_time - start_time:.2f} seconds")
+                st.write_stream(answer_chunks)
+            else:
+                with st.spinner("Processing..."):
+                    if USE_ASYNC_PIPELINE:
+                        answer_data = run_async(get_answer_async(user_input, model_choice, DEFER_RELEVANCE))
+                    else:
+                        answer_data = get_answer(user_input, model_choice, DEFER_RELEVANCE)
 
                 st.success("Completed!")
                 st.write(answer_data["answer"])
 
-                # Display monitoring information
-                st.write(f"Response time: {answer_data['response_time']:.2f} seconds")
-                st.write(f"Relevance: {answer_data['relevance']}")
-                st.write(f"Model used: {answer_data['model_used']}")
-                st.write(f"Total tokens: {answer_data['total_tokens']}")
+            end_time = time.time()
 
-                if answer_data["claude_cost"] > 0:
-                    st.write(f"Claude AI cost: ${answer_data['claude_cost']:.4f}")
+            print_log(f"Answer received in {end_time - start_time:.2f} seconds")
+            print_log("Stage timings: " + ", ".join(
+                f"{stage} {seconds:.3f}s" for stage, seconds in answer_data.get("stage_timings", {}).items()
+            ))
 
-                # Save conversation to database
-                print_log("Saving conversation to database")
+            # Display monitoring information
+            if answer_data.get("cache_hit"):
+                st.write("Served from the answer cache")
 
-                save_conversation(st.session_state.conversation_id, user_input, answer_data)
-                
-                print_log("Conversation saved successfully")
+            st.write(f"Response time: {answer_data['response_time']:.2f} seconds")
+
+            if answer_data.get("time_to_first_token") is not None:
+                st.write(f"Time to first token: {answer_data['time_to_first_token']:.2f} seconds")
+
+            st.write(f"Relevance: {answer_data['relevance']}")
+            st.write(f"Model used: {answer_data['model_used']}")
+
+            if answer_data.get("routing_decision"):
+                st.write(f"Routed automatically: {answer_data['routing_decision']['reason']}")
+                print_log(f"Routing decision: {answer_data['routing_decision']}")
+            st.write(f"Total tokens: {answer_data['total_tokens']}")
+
+            if answer_data["claude_cost"] > 0:
+                st.write(f"Claude AI cost: ${answer_data['claude_cost']:.4f}")
 
-                # Store the last used conversation_id and generate a new one for the next question
-                st.session_state.last_conversation_id = st.session_state.conversation_id
-                st.session_state.conversation_id = str(uuid.uuid4())
-                st.session_state.feedback_given = False
+            # Save conversation to database
+            print_log("Saving conversation to database")
+
+            save_conversation(st.session_state.conversation_id, user_input, answer_data)
+            
+            print_log("Conversation saved successfully")
+
+            # cached answers were judged RELEVANT before they were stored, and judging them again
+            # would only add another copy to the cache
+            if DEFER_RELEVANCE and not answer_data.get("cache_hit"):
+                get_relevance_queue().submit(
+                    st.session_state.conversation_id, user_input, answer_data["answer"], answer_data["model_used"]
+                )
+
+                print_log("Conversation queued for relevance evaluation")
+
+            # Store the last used conversation_id and generate a new one for the next question
+            st.session_state.last_conversation_id = st.session_state.conversation_id
+            st.session_state.conversation_id = str(uuid.uuid4())
+            st.session_state.feedback_given = False
 
     # Feedback buttons in columns
     col1, col2 = st.columns(2)
@@ -114,13 +221,23 @@ def main():
 
     st.write(f"Current count: {st.session_state.count}")
 
-    # Recent conversations expander
-    with st.expander("Recent Conversations"):
+    # Dashboard sections only query the database once they're opened
+    recent_conversations_section()
+    feedback_statistics_section()
+    pie_charts_section()
+
+
+@st.fragment
+def recent_conversations_section():
+    if not st.toggle("Recent Conversations", key="show_recent_conversations"):
+        return
+
+    with st.container(border=True):
         relevance_filter = st.selectbox(
             "Filter by relevance:", ["All", "RELEVANT", "PARTLY_RELEVANT", "NON_RELEVANT"]
         )
 
-        recent_conversations = get_recent_conversations(
+        recent_conversations = load_recent_conversations(
             limit=5, relevance=relevance_filter if relevance_filter != "All" else None
         )
 
@@ -131,59 +248,38 @@ def main():
             st.write(f"Model: {conv['model_used']}")
             st.write("---")
 
-    # Feedback statistics expander
-    with st.expander("Feedback Statistics"):
-        feedback_stats = get_feedback_stats()
+
+@st.fragment
+def feedback_statistics_section():
+    if not st.toggle("Feedback Statistics", key="show_feedback_statistics"):
+        return
+
+    with st.container(border=True):
+        feedback_stats = load_feedback_stats()
 
         st.write(f"Thumbs up: {feedback_stats['thumbs_up']}")
         st.write(f"Thumbs down: {feedback_stats['thumbs_down']}")
 
 
+@st.fragment
+def pie_charts_section():
     # Pie charts for relevance and user voting
-    with st.expander("View Pie Charts for LLM Responses"):
-        relevance_data = get_recent_conversations(limit=100) # Fetch relevance data from recent conversations
-        feedback_stats = get_feedback_stats()
+    if not st.toggle("View Pie Charts for LLM Responses", key="show_pie_charts"):
+        return
+
+    with st.container(border=True):
+        relevance_data = load_relevance_distribution(limit=100) # Relevance counts for recent conversations
+        feedback_stats = load_feedback_stats()
         col1, col2 = st.columns(2) # Create 2 pie charts side by side
 
         # Relevance pie-chart
         if relevance_data:
-            relevance_count = {'RELEVANT': 0, 'PARTLY_RELEVANT': 0, 'NON_RELEVANT': 0}
-
-            # Count how many responses fall into each relevance category
-            for conv in relevance_data:
-                if conv['relevance'] == 'RELEVANT':
-                    relevance_count['RELEVANT'] += 1
-                elif conv['relevance'] == 'PARTLY_RELEVANT':
-                    relevance_count['PARTLY_RELEVANT'] += 1
-                elif conv['relevance'] == 'NON_RELEVANT':
-                    relevance_count['NON_RELEVANT'] += 1
-                    
-            # Create labels and sizes for all categories
-            relevance_labels = [label.replace('_', ' ').title() for label in relevance_count.keys()]
-            relevance_sizes = list(relevance_count.values())
-        
-            # Pie chart for relevance
-            with col1:
-                fig1, ax1 = plt.subplots()
-                colors = ["yellow", "aqua", "pink"]
-
-                ax1.pie(
-                    relevance_sizes,
-                    labels=None,
-                    autopct='%1.1f%%',
-                    startangle=90,
-                    labeldistance=1.5,
-                    shadow="true",
-                    colors=colors,
-                    pctdistance=0.8
-                )
-                ax1.axis('equal')  # Equal aspect ratio ensures the pie is drawn as a circle
-                
-                # Add a legend to the pie chart with all categories
-                ax1.legend(relevance_labels, title="Relevance", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-                
-                st.pyplot(fig1)
+            relevance_sizes = tuple(
+                relevance_data.get(label, 0) for label in ['RELEVANT', 'PARTLY_RELEVANT', 'NON_RELEVANT']
+            )
 
+            with col1:
+                st.image(render_relevance_pie(relevance_sizes))
 
             # Display feedback pie-chart
             if feedback_stats and 'thumbs_up' in feedback_stats and 'thumbs_down' in feedback_stats:
@@ -191,25 +287,8 @@ def main():
                 thumbs_down = feedback_stats['thumbs_down']
                 
                 if isinstance(thumbs_up, (int, float)) and isinstance(thumbs_down, (int, float)) and (thumbs_up > 0 or thumbs_down > 0):
-                    voting_labels = ['Helpful', 'Not Helpful']
-                    voting_sizes = [thumbs_up, thumbs_down]
-                
-                    # Pie chart for user voting
                     with col2:
-                        fig2, ax2 = plt.subplots()
-                        colors = ["dodgerblue", "lime"]
-
-                        ax2.pie(
-                            voting_sizes, 
-                            labels=voting_labels, 
-                            autopct='%1.1f%%', 
-                            startangle=90, 
-                            shadow="true", 
-                            colors=colors
-                        )
-                        ax2.axis('equal')
-
-                        st.pyplot(fig2)
+                        st.image(render_voting_pie((thumbs_up, thumbs_down)))
                 else:
                     with col2:
                         st.write("No valid voting data available yet.")
@@ -217,6 +296,86 @@ def main():
         else:
              st.write("No data available yet.")
 
+
+# Dashboard data is cached across reruns and cleared whenever rows reach the database
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL)
+def load_recent_conversations(limit, relevance):
+    return [dict(conv) for conv in get_recent_conversations(limit=limit, relevance=relevance)]
+
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL)
+def load_feedback_stats():
+    return dict(get_feedback_stats())
+
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL)
+def load_relevance_distribution(limit):
+    return get_relevance_distribution(limit=limit)
+
+
+def clear_dashboard_cache():
+    load_recent_conversations.clear()
+    load_feedback_stats.clear()
+    load_relevance_distribution.clear()
+
+
+# Rendered charts are cached by their inputs, so unchanged data is never re-plotted
+
+def figure_to_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+
+    return buffer.getvalue()
+
+
+@st.cache_data(max_entries=32)
+def render_relevance_pie(relevance_sizes):
+    # Create labels for all categories
+    relevance_labels = [label.replace('_', ' ').title() for label in ['RELEVANT', 'PARTLY_RELEVANT', 'NON_RELEVANT']]
+
+    fig1, ax1 = plt.subplots()
+    colors = ["yellow", "aqua", "pink"]
+
+    ax1.pie(
+        relevance_sizes,
+        labels=None,
+        autopct='%1.1f%%',
+        startangle=90,
+        labeldistance=1.5,
+        shadow="true",
+        colors=colors,
+        pctdistance=0.8
+    )
+    ax1.axis('equal')  # Equal aspect ratio ensures the pie is drawn as a circle
+    
+    # Add a legend to the pie chart with all categories
+    ax1.legend(relevance_labels, title="Relevance", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+
+    return figure_to_png(fig1)
+
+
+@st.cache_data(max_entries=32)
+def render_voting_pie(voting_sizes):
+    voting_labels = ['Helpful', 'Not Helpful']
+
+    fig2, ax2 = plt.subplots()
+    colors = ["dodgerblue", "lime"]
+
+    ax2.pie(
+        voting_sizes, 
+        labels=voting_labels, 
+        autopct='%1.1f%%', 
+        startangle=90, 
+        shadow="true", 
+        colors=colors
+    )
+    ax2.axis('equal')
+
+    return figure_to_png(fig2)
+
+
 if __name__ == "__main__":
     print_log("Hack for LA Contributor Assistant app started...")
     main()
\ No newline at end of file
@@ -1,29 +1,251 @@
 import os
+import re
 import time
 import json
+import asyncio
+import threading
+import weakref
 import anthropic
-from elasticsearch import Elasticsearch
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import Elasticsearch, AsyncElasticsearch
+from embedding_cache import QueryEmbeddingCache
+from embeddings import backend_label, load_encoder
+from embedding_batcher import EmbeddingBatcher
+from answer_cache import SemanticAnswerCache
+from local_search import LocalIndex
+from resilience import (
+    SEARCH_HEDGING, CircuitOpenError, DeadlineExceeded, deadline, get_breaker, get_hedger, stage_timeout,
+)
+from router import ModelRouter
+from tracing import metrics, record, span, trace
 
 # doing hybrid search with rrf
 
 ELASTIC_URL = os.getenv("ELASTIC_URL", "http://elasticsearch:9200")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "your-api-key-here")
+MODEL_NAME = os.getenv("MODEL_NAME", "multi-qa-MiniLM-L6-cos-v1")
 
+# alias maintained by prep.py; it always points at the live versioned index
+INDEX_NAME = os.getenv("INDEX_NAME", "contributing_h4la")
 
-es_client = Elasticsearch(ELASTIC_URL)
-claude_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-model = SentenceTransformer("multi-qa-MiniLM-L6-cos-v1")
+# "elasticsearch", or "local" for the in-process NumPy/BM25 index built from LOCAL_DOCUMENTS_PATH;
+# the default is data/documents.json next to app/, which the Docker image copies to /data
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "elasticsearch")
+LOCAL_DOCUMENTS_PATH = os.getenv(
+    "LOCAL_DOCUMENTS_PATH", os.path.join(os.path.dirname(__file__), "..", "data", "documents.json")
+)
+LOCAL_VECTORS_PATH = os.getenv("LOCAL_VECTORS_PATH")
+
+# how the kNN and keyword legs are sent: "sequential", "msearch" or "concurrent"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "sequential")
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "8"))
+
+# LRU cache of query vectors; size 0 disables it, a path adds the on-disk tier
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+
+# encode concurrent queries as one batch, waiting at most EMBED_BATCH_WAIT_MS for company
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "false").lower() == "true"
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+
+# answers to near-duplicate questions; size 0 disables the semantic cache
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+# only the fields needed downstream: build_prompt uses page_content, evaluation matches on id
+SOURCE_FIELDS = ["id", "page_content"]
+
+# prompt context limits: chunks are packed up to the budget, near-duplicates are dropped
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+CONTEXT_OVERLAP_THRESHOLD = 0.8
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Claude errors that mean the model is unavailable right now (rate limits, overload (529), 503 and
+# other 5xx, timeouts), as opposed to a bad request; only these count towards opening its circuit breaker.
+# OverloadedError and ServiceUnavailableError don't subclass InternalServerError, so they are listed too.
+CLAUDE_UNAVAILABLE_ERRORS = (
+    anthropic.RateLimitError, anthropic.OverloadedError, anthropic.ServiceUnavailableError,
+    anthropic.InternalServerError, anthropic.APIConnectionError,
+)
+
+KEYWORD_FIELDS = ["page_content^2", "header_1", "header_2", "header_3", "header_4", "header_5"]
+
+# async clients are tied to the event loop they were created on
+async_clients = weakref.WeakKeyDictionary()
+async_clients_lock = threading.Lock()
+background_loop = None
+
+
+# Clients, the embedding model and caches are built on first use and shared by the process,
+# so importing this module is cheap. Call warm_up() to pay the cost before the first request.
+
+singletons = {}
+singletons_lock = threading.RLock()
+
+
+def get_singleton(name, factory):
+    if name not in singletons:
+        with singletons_lock:
+            if name not in singletons:
+                singletons[name] = factory()
+
+    return singletons[name]
+
+
+def set_singleton(name, instance):
+    """Replace a shared object, e.g. with a stand-in client for load tests."""
+    with singletons_lock:
+        singletons[name] = instance
+
+
+def get_es_client():
+    return get_singleton('es_client', lambda: Elasticsearch(ELASTIC_URL))
+
+
+def get_claude_client():
+    return get_singleton('claude_client', lambda: anthropic.Anthropic(api_key=ANTHROPIC_API_KEY))
+
+
+def claude_messages(client, timeout=None):
+    """
+    The messages API of `client`, limited to `timeout` seconds when it isn't None.
+
+    The SDK retries timeouts, 5xx and 529 on its own (twice by default), which would let one
+    call run to three times its timeout and hide overloads from the breakers and the Haiku
+    fallback; under a deadline a single attempt is made.
+    """
+    if timeout is None:
+        return client.messages
+
+    return client.with_options(max_retries=0, timeout=timeout).messages
+
+
+def get_es_client_for(timeout):
+    """The shared client, with `timeout` seconds as the request timeout when it isn't None."""
+    if timeout is None:
+        return get_es_client()
+
+    return get_es_client().options(request_timeout=timeout)
+
+
+def get_claude_breaker(name):
+    # a model choice such as "claude/3-haiku" or a role such as "judge"
+    return get_breaker(f"claude.{name.removeprefix('claude/')}", failure_types=CLAUDE_UNAVAILABLE_ERRORS)
+
+
+def get_model():
+    # EMBEDDING_BACKEND picks the PyTorch SentenceTransformer or the quantized ONNX session
+    return get_singleton('model', lambda: load_encoder(MODEL_NAME))
+
+
+def get_search_executor():
+    # used by the "concurrent" retrieval mode, one thread per search leg
+    return get_singleton('search_executor', lambda: ThreadPoolExecutor(max_workers=SEARCH_WORKERS))
+
+
+def get_embedding_batcher():
+    def create():
+        if not EMBED_BATCHING:
+            return None
+
+        return EmbeddingBatcher(
+            lambda queries: get_model().encode(queries, batch_size=EMBED_MAX_BATCH),
+            max_wait=EMBED_BATCH_WAIT_MS / 1000, max_batch=EMBED_MAX_BATCH,
+        )
+
+    return get_singleton('embedding_batcher', create)
+
+
+def get_query_embedding_cache():
+    def create():
+        if EMBEDDING_CACHE_SIZE <= 0:
+            return None
+
+        return QueryEmbeddingCache(
+            embed, max_size=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH,
+            model=MODEL_NAME, backend=backend_label(),
+        )
+
+    return get_singleton('query_embedding_cache', create)
+
+
+def get_answer_cache():
+    def create():
+        if ANSWER_CACHE_SIZE <= 0:
+            return None
+
+        return SemanticAnswerCache(
+            threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_size=ANSWER_CACHE_SIZE
+        )
+
+    return get_singleton('answer_cache', create)
+
+
+def get_router():
+    return get_singleton('router', lambda: ModelRouter(calculate_claude_cost))
+
+
+def get_local_index():
+    def create():
+        if not os.path.exists(LOCAL_DOCUMENTS_PATH):
+            raise FileNotFoundError(
+                f"RETRIEVAL_BACKEND=local needs the documents at LOCAL_DOCUMENTS_PATH, "
+                f"but {os.path.abspath(LOCAL_DOCUMENTS_PATH)} does not exist"
+            )
+
+        return LocalIndex.from_files(
+            LOCAL_DOCUMENTS_PATH, get_model().encode, LOCAL_VECTORS_PATH, model=MODEL_NAME, backend=backend_label()
+        )
+
+    return get_singleton('local_index', create)
+
+
+def warm_up():
+    """Build everything the first request needs, including one dummy encode; returns seconds taken."""
+    start_time = time.time()
+
+    get_model().encode("warm up")
+    get_embedding_batcher()
+    get_query_embedding_cache()
+    get_answer_cache()
+    get_claude_client()
+
+    if RETRIEVAL_BACKEND == "local":
+        get_local_index()
+    else:
+        get_es_client()
+
+    return time.time() - start_time
+
+
+def embed(query):
+    """Encode one query with the model, through the micro-batcher when it is enabled."""
+    embedding_batcher = get_embedding_batcher()
+
+    if embedding_batcher is not None:
+        return embedding_batcher.encode(query)
+
+    return get_model().encode(query)
+
+
+def encode_query(query):
+    query_embedding_cache = get_query_embedding_cache()
+
+    with span("embed"):
+        if query_embedding_cache is not None:
+            return query_embedding_cache.encode(query)
+
+        return embed(query)
 
 
 def compute_rrf(rank, k=60):
     """ Own implementation of the relevance score """
     return 1 / (k + rank)
 
-def elastic_search_hybrid_rrf(field, query, vector, k=60, index_name="contributing_h4la"):
-    """Apply Reciprocal Rank Fusion (RRF) to combine and rerank search results."""
-
-    knn_query = {
+def build_knn_query(field, vector):
+    return {
         "knn": {
             "field": field,
             "query_vector": vector,
@@ -31,31 +253,44 @@ def elastic_search_hybrid_rrf(field, query, vector, k=60, index_name="contributi
             "num_candidates": 1000,
             "boost": 0.5,
         },
-        "size": 10
+        "size": 10,
+        "_source": SOURCE_FIELDS,
     }
-    
-    keyword_query = {
+
+
+def build_keyword_query(query, keyword_fields=None):
+    return {
         "query": {
             "multi_match": {
                 "query": query,
-                "fields": ["page_content^2", "header_1", "header_2", "header_3", "header_4", "header_5"],
+                "fields": keyword_fields or KEYWORD_FIELDS,
                 "type": "best_fields",
                 "boost": 0.5,
             }
         },
-        "size": 10
+        "size": 10,
+        "_source": SOURCE_FIELDS,
     }
-    
-    # Perform searches
-    knn_results = es_client.search(index=index_name, body=knn_query)['hits']['hits']
-    keyword_results = es_client.search(index=index_name, body=keyword_query)['hits']['hits']
-    
-    # Apply RRF
+
+
+def fuse_results(knn_results, keyword_results, k=60, top_n=5):
+    """
+    Fuse the two hit lists with RRF.
+
+    Returns the top ids, the sources already in the hits, the scores and each document's
+    1-based rank in the kNN and keyword legs (None where a leg didn't return it).
+    """
     rrf_scores = {}
+    sources = {}
+    leg_ranks = {}
     
     for rank, hit in enumerate(knn_results):
         doc_id = hit['_id']
         rrf_scores[doc_id] = compute_rrf(rank + 1, k)
+        leg_ranks[doc_id] = {'knn_rank': rank + 1, 'keyword_rank': None}
+
+        if '_source' in hit:
+            sources[doc_id] = hit['_source']
     
     for rank, hit in enumerate(keyword_results):
         doc_id = hit['_id']
@@ -64,27 +299,315 @@ def elastic_search_hybrid_rrf(field, query, vector, k=60, index_name="contributi
             rrf_scores[doc_id] += compute_rrf(rank + 1, k)
         else:
             rrf_scores[doc_id] = compute_rrf(rank + 1, k)
+
+        leg_ranks.setdefault(doc_id, {'knn_rank': None, 'keyword_rank': None})['keyword_rank'] = rank + 1
+
+        if '_source' in hit:
+            sources.setdefault(doc_id, hit['_source'])
     
     # Sort and get top results
     reranked_docs = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
+    top_ids = [doc_id for doc_id, score in reranked_docs[:top_n]]
+
+    return top_ids, sources, rrf_scores, leg_ranks
+
+
+def fused_result(source, doc_id, rrf_scores, leg_ranks):
+    # the fused score and leg ranks go along with each document; the model router reads them as retrieval confidence
+    return {**source, 'rrf_score': rrf_scores[doc_id], **leg_ranks[doc_id]}
+
+
+def add_fetched_sources(sources, fetched):
+    for doc in fetched:
+        if doc.get('found'):
+            sources[doc['_id']] = doc['_source']
+
+
+def timed_search(index_name, body, timeout=None):
+    """Run one search leg and return its hits with the wall-clock time it took."""
+    start_time = time.time()
+    response = get_es_client_for(timeout).search(index=index_name, body=body)
+
+    return response['hits']['hits'], time.time() - start_time
+
+
+def run_leg(leg, index_name, body, timeout=None):
+    """
+    Run one search leg through its circuit breaker, hedged when it is slower than usual.
+
+    Returns (hits, seconds, error) rather than raising, so the other leg can carry on alone.
+    The seconds include any wait before a hedge was sent.
+    """
+    def search():
+        return timed_search(index_name, body, timeout)
+
+    def hedged_search():
+        return get_hedger(f"es.{leg}").call(search, timeout)
+
+    start_time = time.time()
+
+    try:
+        hits, _ = get_breaker(f"es.{leg}").call(hedged_search if SEARCH_HEDGING else search)
+    except Exception as e:
+        return None, None, e
+
+    return hits, time.time() - start_time, None
+
+
+def msearch_legs(index_name, knn_query, keyword_query, timeout=None):
+    """
+    Both legs in one round trip; returns (hits, seconds, error) per leg like run_leg.
+
+    A leg whose breaker is open is left out of the request and gets a CircuitOpenError,
+    so the other leg carries on alone as in the other modes.
+    """
+    outcomes = {}
+    sent = {}
+
+    for leg, body in (('knn', knn_query), ('keyword', keyword_query)):
+        breaker = get_breaker(f"es.{leg}")
+
+        try:
+            breaker.allow()
+        except CircuitOpenError as e:
+            outcomes[leg] = (None, None, e)
+        else:
+            sent[leg] = (breaker, body)
+
+    if sent:
+        searches = [part for _, body in sent.values() for part in ({"index": index_name}, body)]
+
+        try:
+            responses = get_breaker("es.msearch").call(
+                lambda: get_es_client_for(timeout).msearch(searches=searches)['responses']
+            )
+        except BaseException:
+            # the round trip failed as a whole, which the msearch breaker has already judged
+            for breaker, _ in sent.values():
+                breaker.release()
+            raise
+
+        for (leg, (breaker, _)), response in zip(sent.items(), responses):
+            if 'error' in response:
+                breaker.record_failure()
+                outcomes[leg] = (None, None, RuntimeError(f"msearch leg failed: {response['error']}"))
+            else:
+                # both legs share one round trip, so per-leg times come from Elasticsearch's 'took'
+                breaker.record_success()
+                outcomes[leg] = (response['hits']['hits'], response['took'] / 1000, None)
+
+    return outcomes['knn'], outcomes['keyword']
+
+
+def surviving_legs(knn_outcome, keyword_outcome, timings):
+    """
+    Hits of both legs, with a failed leg replaced by no hits, e.g. keyword-only results
+    while kNN is down. Only when both legs failed is the error raised.
+    """
+    outcomes = {'knn': knn_outcome, 'keyword': keyword_outcome}
+
+    if knn_outcome[2] is not None and keyword_outcome[2] is not None:
+        raise knn_outcome[2]
+
+    for leg, (_, seconds, error) in outcomes.items():
+        if error is None:
+            timings[leg] = seconds
+        else:
+            metrics.increment("rag_search_fallbacks_total", failed_leg=leg)
+            print(f"{leg} search failed, using the other leg only: {error!r}", flush=True)
+
+    return knn_outcome[0] or [], keyword_outcome[0] or []
+
+
+def search_legs(index_name, knn_query, keyword_query, mode, timings, timeout=None):
+    """Run the kNN and keyword legs using the selected retrieval mode, each limited to `timeout` seconds."""
+    start_time = time.time()
+
+    if mode == "msearch":
+        knn_outcome, keyword_outcome = msearch_legs(index_name, knn_query, keyword_query, timeout)
+    elif mode == "concurrent":
+        knn_future = get_search_executor().submit(run_leg, "knn", index_name, knn_query, timeout)
+        keyword_future = get_search_executor().submit(run_leg, "keyword", index_name, keyword_query, timeout)
+        knn_outcome, keyword_outcome = knn_future.result(), keyword_future.result()
+    elif mode == "sequential":
+        knn_outcome = run_leg("knn", index_name, knn_query, timeout)
+        keyword_outcome = run_leg("keyword", index_name, keyword_query, timeout)
+    else:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+
+    knn_results, keyword_results = surviving_legs(knn_outcome, keyword_outcome, timings)
+    timings['round_trip'] = time.time() - start_time
+
+    return knn_results, keyword_results
+
+
+def record_search_timings(timings):
+    # the legs may run on other threads or share a round trip, so they are timed by the caller
+    for leg in ('knn', 'keyword'):
+        if leg in timings:
+            record(f"search.{leg}", timings[leg])
+
+
+def elastic_search_hybrid_rrf(field, query, vector, k=60, index_name=INDEX_NAME,
+                              mode=None, timings=None, keyword_fields=None):
+    """
+    Apply Reciprocal Rank Fusion (RRF) to combine and rerank search results.
+
+    `mode` selects how the two legs are sent ("sequential", "msearch" or "concurrent")
+    and defaults to RETRIEVAL_MODE. Pass a dict as `timings` to receive the seconds
+    spent on each leg ('knn', 'keyword') and on the whole search ('round_trip').
+    `keyword_fields` overrides the multi_match fields and boosts.
+
+    Under a deadline, each request gets the search stage's share of it as a timeout.
+    If one leg fails or its circuit breaker is open, the other leg's results are used.
+    """
+    if mode is None:
+        mode = RETRIEVAL_MODE
+    if timings is None:
+        timings = {}
+
+    knn_query = build_knn_query(field, vector)
+    keyword_query = build_keyword_query(query, keyword_fields)
+    timeout = stage_timeout("search")
     
-    final_results = []
+    # Perform searches
+    knn_results, keyword_results = search_legs(index_name, knn_query, keyword_query, mode, timings, timeout)
+    record_search_timings(timings)
     
-    for doc_id, score in reranked_docs[:5]:
-        doc = es_client.get(index=index_name, id=doc_id)
-        
-        final_results.append(doc['_source'])
+    top_ids, sources, rrf_scores, leg_ranks = fuse_results(knn_results, keyword_results, k)
+
+    # Hits normally carry their _source; fetch any that don't in one round trip
+    missing_ids = [doc_id for doc_id in top_ids if doc_id not in sources]
+
+    if missing_ids:
+        with span("search.fetch"):
+            fetched = get_es_client_for(timeout).mget(index=index_name, ids=missing_ids, source=SOURCE_FIELDS)
+        add_fetched_sources(sources, fetched['docs'])
+
+    final_results = [
+        fused_result(sources[doc_id], doc_id, rrf_scores, leg_ranks) for doc_id in top_ids if doc_id in sources
+    ]
 
     return final_results
 
 
+def local_search_hybrid_rrf(field, query, vector, k=60, timings=None):
+    """Same results as elastic_search_hybrid_rrf, served from the in-process index."""
+    if field != 'page_content_vector':
+        raise ValueError(f"The local index only holds page_content_vector, not {field}")
+    if timings is None:
+        timings = {}
+
+    index = get_local_index()
+
+    start_time = time.time()
+    knn_results = index.knn_hits(vector)
+    timings['knn'] = time.time() - start_time
+
+    keyword_results = index.keyword_hits(query)
+    timings['keyword'] = time.time() - start_time - timings['knn']
+    timings['round_trip'] = time.time() - start_time
+    record_search_timings(timings)
+
+    top_ids, sources, rrf_scores, leg_ranks = fuse_results(knn_results, keyword_results, k)
+
+    return [
+        fused_result(
+            {key: sources[doc_id][key] for key in SOURCE_FIELDS if key in sources[doc_id]}, doc_id, rrf_scores, leg_ranks
+        )
+        for doc_id in top_ids
+    ]
+
+
+def hybrid_search(field, query, vector, k=60, timings=None):
+    """Run hybrid RRF retrieval on the configured RETRIEVAL_BACKEND."""
+    if RETRIEVAL_BACKEND == "local":
+        return local_search_hybrid_rrf(field, query, vector, k, timings=timings)
+
+    if RETRIEVAL_BACKEND == "elasticsearch":
+        return elastic_search_hybrid_rrf(field, query, vector, k, timings=timings)
+
+    raise ValueError(f"Unknown retrieval backend: {RETRIEVAL_BACKEND}")
+
+
+# static instructions go in a cached system block so they aren't re-processed on every call
+SYSTEM_PROMPT = """
+You're an assistant to an open source software engineering project on github. Answer the QUESTION based on
+the CONTEXT from our contributor FAQ database.
+Use only the facts and relevant hyperlinks, if any, from the CONTEXT when answering the QUESTION.
+Refrain from referring to the documentation as "context". Instead, refer to it as the "contributing guidelines".
+""".strip()
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) used for budgeting the context."""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_sentences(text, max_tokens):
+    """Keep whole sentences from the start of text until max_tokens would be exceeded."""
+    kept = ""
+
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        candidate = f"{kept} {sentence}" if kept else sentence
+
+        if estimate_tokens(candidate) > max_tokens:
+            break
+
+        kept = candidate
+
+    return kept
+
+
+def shingles(text, size=5):
+    words = text.lower().split()
+
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def pack_context(search_results, token_budget=None):
+    """
+    Fit retrieved chunks, in rank order, into a token budget.
+
+    Chunks that mostly repeat a higher-ranked chunk are dropped, and the chunk that
+    crosses the budget is cut at a sentence boundary.
+    """
+    if token_budget is None:
+        token_budget = CONTEXT_TOKEN_BUDGET
+
+    packed = []
+    kept_shingles = []
+    remaining = token_budget
+
+    for doc in search_results:
+        content = doc['page_content'].strip()
+        doc_shingles = shingles(content)
+
+        if any(len(doc_shingles & other) / min(len(doc_shingles), len(other)) >= CONTEXT_OVERLAP_THRESHOLD
+               for other in kept_shingles):
+            continue
+
+        doc_tokens = estimate_tokens(content)
+
+        if doc_tokens > remaining:
+            content = truncate_to_sentences(content, remaining)
+            doc_tokens = estimate_tokens(content)
+
+            if not content:
+                break
+
+        packed.append({**doc, 'page_content': content})
+        kept_shingles.append(doc_shingles)
+        remaining -= doc_tokens
+
+        if remaining <= 0:
+            break
+
+    return packed
+
+
 def build_prompt(query, search_results):
     prompt_template = """
-    You're an assistant to an open source software engineering project on github. Answer the QUESTION based on
-    the CONTEXT from our contributor FAQ database.
-    Use only the facts and relevant hyperlinks, if any, from the CONTEXT when answering the QUESTION.
-    Refrain from referring to the documentation as "context". Instead, refer to it as the "contributing guidelines".
-
     QUESTION: {question}
 
     CONTEXT:
@@ -95,39 +618,65 @@ def build_prompt(query, search_results):
     page_content: {page_content}
     """.strip()
 
-    context = ""
-    
-    for doc in search_results:
-        context = context + entry_template.format(**doc) + "\n\n"
+    context = "\n\n".join(entry_template.format(**doc) for doc in pack_context(search_results))
 
     prompt = prompt_template.format(question=query, context=context).strip()
 
     return prompt
 
 
-def llm(prompt, model_choice):
-    start_time = time.time()
-
+def resolve_model(model_choice):
     if model_choice.startswith('claude/'):
-        model_type = "claude-3-haiku-20240307" if "haiku" in model_choice else "claude-3-5-sonnet-20240620"
-        
-        response = claude_client.messages.create(
-            model= model_type,
-            max_tokens=1024,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
+        return "claude-3-haiku-20240307" if "haiku" in model_choice else "claude-3-5-sonnet-20240620"
 
-        answer = response.content[0].text
+    raise ValueError(f"Unknown model choice: {model_choice}")
 
-        tokens = {
-            'prompt_tokens': response.usage.input_tokens,
-            'completion_tokens': response.usage.output_tokens,
-            'total_tokens': response.usage.input_tokens + response.usage.output_tokens
-        }
-    else:
-        raise ValueError(f"Unknown model choice: {model_choice}")
+
+def usage_tokens(usage):
+    cache_creation_tokens = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    cache_read_tokens = getattr(usage, 'cache_read_input_tokens', None) or 0
+
+    return {
+        'prompt_tokens': usage.input_tokens,
+        'completion_tokens': usage.output_tokens,
+        'cache_creation_tokens': cache_creation_tokens,
+        'cache_read_tokens': cache_read_tokens,
+        'total_tokens': usage.input_tokens + cache_creation_tokens + cache_read_tokens + usage.output_tokens
+    }
+
+
+def message_params(prompt, model_choice, system=None):
+    """Arguments for messages.create/stream; a system prompt is sent as a cacheable block."""
+    params = {
+        'model': resolve_model(model_choice),
+        'max_tokens': 1024,
+        'messages': [
+            {"role": "user", "content": prompt}
+        ],
+    }
+
+    if system:
+        params['system'] = [
+            {"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}
+        ]
+
+    return params
+
+
+def llm(prompt, model_choice, system=None, timeout=None, breaker=None):
+    """
+    One Claude call, through the circuit breaker `breaker` (named after the model by default).
+
+    `timeout` limits the request in seconds, with no SDK retries; None leaves the client's defaults.
+    """
+    start_time = time.time()
+    params = message_params(prompt, model_choice, system)
+
+    messages = claude_messages(get_claude_client(), timeout)
+    response = get_claude_breaker(breaker or model_choice).call(messages.create, **params)
+
+    answer = response.content[0].text
+    tokens = usage_tokens(response.usage)
     
     end_time = time.time()
     response_time = end_time - start_time
@@ -135,30 +684,72 @@ def llm(prompt, model_choice):
     return answer, tokens, response_time
 
 
-def evaluate_relevance(question, answer):
-    prompt_template = """
-    You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
-    Your task is to analyze the relevance of the generated answer to the given question.
-    Based on the relevance of the generated answer, you will classify it
-    as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
+def llm_stream(prompt, model_choice, result, system=None, timeout=None):
+    """
+    Yield the answer text as Claude streams it.
+
+    Once the stream is exhausted `result` holds the full answer, its tokens, the
+    response_time, the time_to_first_token and the generation_time (first to last token).
+    """
+    start_time = time.time()
+    first_token_time = None
+    params = message_params(prompt, model_choice, system)
 
-    Here is the data for evaluation:
+    breaker = get_claude_breaker(model_choice)
+    breaker.allow()
 
-    Question: {question}
-    Generated Answer: {answer}
+    try:
+        with claude_messages(get_claude_client(), timeout).stream(**params) as stream:
+            for text in stream.text_stream:
+                if first_token_time is None:
+                    first_token_time = time.time()
 
-    Please analyze the content and context of the generated answer in relation to the question
-    and provide your evaluation in parsable JSON without using code blocks:
+                yield text
 
-    {{
-      "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
-      "Explanation": "[Provide a brief explanation for your evaluation]"
-    }}
-    """.strip()
+            message = stream.get_final_message()
+    except CLAUDE_UNAVAILABLE_ERRORS:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # includes the consumer abandoning the stream
+        breaker.release()
+        raise
 
-    prompt = prompt_template.format(question=question, answer=answer)
-    evaluation, tokens, _ = llm(prompt, 'claude/3-haiku')
-    
+    breaker.record_success()
+    end_time = time.time()
+
+    if first_token_time is None:
+        first_token_time = end_time
+
+    result['answer'] = "".join(block.text for block in message.content if block.type == "text")
+    result['tokens'] = usage_tokens(message.usage)
+    result['response_time'] = end_time - start_time
+    result['time_to_first_token'] = first_token_time - start_time
+    result['generation_time'] = end_time - first_token_time
+
+
+EVALUATION_PROMPT_TEMPLATE = """
+You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
+Your task is to analyze the relevance of the generated answer to the given question.
+Based on the relevance of the generated answer, you will classify it
+as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
+
+Here is the data for evaluation:
+
+Question: {question}
+Generated Answer: {answer}
+
+Please analyze the content and context of the generated answer in relation to the question
+and provide your evaluation in parsable JSON without using code blocks:
+
+{{
+  "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
+  "Explanation": "[Provide a brief explanation for your evaluation]"
+}}
+""".strip()
+
+
+def parse_evaluation(evaluation, tokens):
     try:
         json_eval = json.loads(evaluation)
 
@@ -167,6 +758,31 @@ def evaluate_relevance(question, answer):
         return "UNKNOWN", "Failed to parse evaluation", tokens
 
 
+def evaluate_relevance(question, answer, timeout=None):
+    prompt = EVALUATION_PROMPT_TEMPLATE.format(question=question, answer=answer)
+
+    # the judge has its own breaker, so shedding evaluations doesn't stop Haiku answers
+    with span("evaluation"):
+        evaluation, tokens, _ = llm(prompt, 'claude/3-haiku', timeout=timeout, breaker="judge")
+    
+    return parse_evaluation(evaluation, tokens)
+
+
+def judge_answer(question, answer):
+    """
+    evaluate_relevance within the request's deadline.
+
+    When the judge is overloaded, its breaker is open or the deadline has run out, the
+    evaluation is skipped (UNKNOWN) rather than holding back an answer that is ready.
+    """
+    try:
+        return evaluate_relevance(question, answer, stage_timeout("evaluation"))
+    except CLAUDE_UNAVAILABLE_ERRORS + (CircuitOpenError, DeadlineExceeded) as e:
+        metrics.increment("rag_evaluations_skipped_total", reason=type(e).__name__)
+
+        return "UNKNOWN", f"Evaluation skipped: {type(e).__name__}", NO_TOKENS
+
+
 def calculate_claude_pricing(prompt_tokens, completion_tokens, 
                                  price_per_1m_prompt_tokens, 
                                  price_per_1m_completion_tokens):
@@ -199,23 +815,239 @@ def calculate_claude_cost(model_choice, tokens):
     claude_cost = 0
 
     if model_choice == 'claude/3-haiku':
-        claude_cost = (tokens['prompt_tokens'] * 0.00025 + tokens['completion_tokens'] * 0.000125) / 1000
+        prompt_price, completion_price = 0.00025, 0.000125
     else:
-        claude_cost = (tokens['prompt_tokens'] * 0.003 + tokens['completion_tokens'] * 0.015) / 1000
+        prompt_price, completion_price = 0.003, 0.015
+
+    # prompt cache writes cost 25% more than base input tokens, cache reads 90% less
+    prompt_cost = (
+        tokens['prompt_tokens']
+        + tokens.get('cache_creation_tokens', 0) * 1.25
+        + tokens.get('cache_read_tokens', 0) * 0.1
+    ) * prompt_price
+
+    claude_cost = (prompt_cost + tokens['completion_tokens'] * completion_price) / 1000
 
     return claude_cost
 
 
-def get_answer(query, model_choice):
-    vector = model.encode(query)
+# placeholder judgement for answers whose relevance is evaluated later by relevance_queue
+PENDING_RELEVANCE = "PENDING"
+NO_TOKENS = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
 
-    search_results = elastic_search_hybrid_rrf('page_content_vector', query, vector)
-    prompt = build_prompt(query, search_results)
+# model choice that lets the router pick Haiku or Sonnet per question
+AUTO_MODEL = "auto"
 
-    answer, tokens, response_time = llm(prompt, model_choice)
-    
-    relevance, explanation, eval_tokens = evaluate_relevance(query, answer)
 
+def route_model(query, model_choice, search_results, prompt, elapsed):
+    """Resolve "auto" to a model; returns the model choice and the routing decision, None if chosen by hand."""
+    if model_choice != AUTO_MODEL:
+        return model_choice, None
+
+    with span("route"):
+        return get_router().choose(query, search_results, estimate_tokens(SYSTEM_PROMPT + prompt), elapsed)
+
+
+def fall_back_to_haiku(model_choice, error):
+    metrics.increment("rag_model_fallbacks_total", model=model_choice)
+    print(f"{model_choice} unavailable ({type(error).__name__}), answering with claude/3-haiku", flush=True)
+
+    return 'claude/3-haiku'
+
+
+def answer_with_fallback(prompt, model_choice, model_fallback=True):
+    """
+    Ask the answer model within the llm stage's share of the deadline.
+
+    While Sonnet is unavailable (overloaded, timing out or its breaker is open) the
+    question goes to Haiku instead, unless `model_fallback` is off. Returns the model
+    used with llm's result.
+    """
+    try:
+        return model_choice, llm(prompt, model_choice, SYSTEM_PROMPT, stage_timeout("llm"))
+    except CLAUDE_UNAVAILABLE_ERRORS + (CircuitOpenError,) as e:
+        if model_choice == 'claude/3-haiku' or not model_fallback:
+            raise
+
+        model_choice = fall_back_to_haiku(model_choice, e)
+
+        return model_choice, llm(prompt, model_choice, SYSTEM_PROMPT, stage_timeout("llm"))
+
+
+def available_model(model_choice, model_fallback=True):
+    """Haiku in place of Sonnet while Sonnet's breaker is open, for streams that can't switch midway."""
+    if not model_fallback:
+        return model_choice
+
+    if model_choice != 'claude/3-haiku' and get_claude_breaker(model_choice).state == "open":
+        metrics.increment("rag_model_fallbacks_total", model=model_choice)
+        return 'claude/3-haiku'
+
+    return model_choice
+
+
+def observe_answer(model_choice, response_time, tokens):
+    get_router().observe(
+        model_choice, response_time, tokens['completion_tokens'], calculate_claude_cost(model_choice, tokens)
+    )
+
+
+def get_cached_answer(vector):
+    """Return answer data for a stored answer to a near-duplicate question, or None."""
+    answer_cache = get_answer_cache()
+
+    if answer_cache is None:
+        return None
+
+    start_time = time.time()
+
+    with span("answer_cache"):
+        match = answer_cache.lookup(vector)
+
+    if match is None:
+        return None
+
+    entry, similarity = match
+
+    answer_data = build_answer_data(
+        entry['answer'], time.time() - start_time, entry['relevance'], entry['relevance_explanation'],
+        entry['model_used'], NO_TOKENS, NO_TOKENS, {}, cache_hit=True
+    )
+    answer_data['cache_similarity'] = similarity
+
+    return answer_data
+
+
+def remember_answer(query, answer, model_choice, relevance, explanation, vector=None):
+    """Offer a judged answer to the semantic cache; only RELEVANT answers are kept."""
+    answer_cache = get_answer_cache()
+
+    if answer_cache is None or relevance != "RELEVANT":
+        return
+
+    if vector is None:
+        vector = encode_query(query)
+
+    answer_cache.add(vector, query, answer, model_choice, relevance, explanation)
+
+
+def get_answer(query, model_choice, defer_evaluation=False, model_fallback=True):
+    # with model_fallback off, an unavailable Sonnet raises instead of being answered by Haiku.
+    # Every span below reports into stage_timings; 'total' is added when the outer span exits.
+    # The deadline splits REQUEST_DEADLINE between search, llm and evaluation.
+    with trace() as stage_timings, span("total"), deadline():
+        start_time = time.perf_counter()
+        vector = encode_query(query)
+
+        cached_answer = get_cached_answer(vector)
+
+        if cached_answer is not None:
+            cached_answer['stage_timings'] = stage_timings
+            return cached_answer
+
+        retrieval_timings = {}
+
+        with span("search"):
+            search_results = hybrid_search('page_content_vector', query, vector, timings=retrieval_timings)
+
+        with span("prompt"):
+            prompt = build_prompt(query, search_results)
+
+        model_choice, routing_decision = route_model(
+            query, model_choice, search_results, prompt, time.perf_counter() - start_time
+        )
+
+        with span("llm"):
+            model_choice, (answer, tokens, response_time) = answer_with_fallback(prompt, model_choice, model_fallback)
+
+        observe_answer(model_choice, response_time, tokens)
+        
+        if defer_evaluation:
+            relevance, explanation, eval_tokens = PENDING_RELEVANCE, "", NO_TOKENS
+        else:
+            relevance, explanation, eval_tokens = judge_answer(query, answer)
+            remember_answer(query, answer, model_choice, relevance, explanation, vector)
+
+        return build_answer_data(answer, response_time, relevance, explanation, model_choice,
+                                 tokens, eval_tokens, retrieval_timings, stage_timings=stage_timings,
+                                 routing_decision=routing_decision)
+
+
+def get_answer_stream(query, model_choice, defer_evaluation=False, model_fallback=True):
+    """
+    Streaming counterpart of get_answer.
+
+    Retrieval runs before this returns; the returned generator then yields answer chunks
+    (e.g. for st.write_stream) and fills the returned dict, with the same keys as
+    get_answer, once it is exhausted.
+    """
+    start_time = time.perf_counter()
+
+    with trace() as stage_timings, deadline() as request_deadline:
+        vector = encode_query(query)
+
+        cached_answer = get_cached_answer(vector)
+
+        if cached_answer is not None:
+            record("total", time.perf_counter() - start_time)
+            cached_answer['stage_timings'] = stage_timings
+            return iter([cached_answer['answer']]), cached_answer
+
+        retrieval_timings = {}
+
+        with span("search"):
+            search_results = hybrid_search('page_content_vector', query, vector, timings=retrieval_timings)
+
+        with span("prompt"):
+            prompt = build_prompt(query, search_results)
+
+        model_choice, routing_decision = route_model(
+            query, model_choice, search_results, prompt, time.perf_counter() - start_time
+        )
+        model_choice = available_model(model_choice, model_fallback)
+
+    answer_data = {}
+
+    def answer_chunks():
+        result = {}
+
+        # entered only around the calls, never across a yield, so it can't leak into the consumer
+        with deadline(existing=request_deadline):
+            timeout = stage_timeout("llm")
+
+        yield from llm_stream(prompt, model_choice, result, SYSTEM_PROMPT, timeout)
+
+        # the generator runs in its consumer's context, so the trace is entered again here;
+        # llm is taken from the stream's own timings to leave out the time spent rendering chunks
+        with trace(stage_timings), deadline(existing=request_deadline):
+            record("llm", result['response_time'])
+            record("llm.first_token", result['time_to_first_token'])
+            observe_answer(model_choice, result['response_time'], result['tokens'])
+
+            if defer_evaluation:
+                relevance, explanation, eval_tokens = PENDING_RELEVANCE, "", NO_TOKENS
+            else:
+                relevance, explanation, eval_tokens = judge_answer(query, result['answer'])
+                remember_answer(query, result['answer'], model_choice, relevance, explanation, vector)
+
+            record("total", time.perf_counter() - start_time)
+
+        answer_data.update(build_answer_data(
+            result['answer'], result['response_time'], relevance, explanation, model_choice,
+            result['tokens'], eval_tokens, retrieval_timings,
+            time_to_first_token=result['time_to_first_token'],
+            generation_time=result['generation_time'],
+            stage_timings=stage_timings,
+            routing_decision=routing_decision,
+        ))
+
+    return answer_chunks(), answer_data
+
+
+def build_answer_data(answer, response_time, relevance, explanation, model_choice,
+                      tokens, eval_tokens, retrieval_timings,
+                      time_to_first_token=None, generation_time=None, cache_hit=False, stage_timings=None,
+                      routing_decision=None):
     claude_cost = calculate_claude_cost(model_choice, tokens)
  
     return {
@@ -227,8 +1059,262 @@ def get_answer(query, model_choice):
         'prompt_tokens': tokens['prompt_tokens'],
         'completion_tokens': tokens['completion_tokens'],
         'total_tokens': tokens['total_tokens'],
+        'cache_creation_tokens': tokens.get('cache_creation_tokens', 0),
+        'cache_read_tokens': tokens.get('cache_read_tokens', 0),
         'eval_prompt_tokens': eval_tokens['prompt_tokens'],
         'eval_completion_tokens': eval_tokens['completion_tokens'],
         'eval_total_tokens': eval_tokens['total_tokens'],
-        'claude_cost': claude_cost
-    }
\ No newline at end of file
+        'claude_cost': claude_cost,
+        'retrieval_timings': retrieval_timings,
+        'time_to_first_token': time_to_first_token,
+        'generation_time': generation_time,
+        'cache_hit': cache_hit,
+        'stage_timings': stage_timings if stage_timings is not None else {},
+        'routing_decision': routing_decision,
+    }
+
+
+# asyncio pipeline
+
+def get_async_clients():
+    """Return the async Elasticsearch and Anthropic clients bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+
+    with async_clients_lock:
+        clients = async_clients.get(loop)
+
+        if clients is None:
+            clients = (
+                AsyncElasticsearch(ELASTIC_URL),
+                anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY),
+            )
+            async_clients[loop] = clients
+
+    return clients
+
+
+async def close_async_clients():
+    """Close the clients of the running event loop, e.g. at the end of a batch run."""
+    with async_clients_lock:
+        clients = async_clients.pop(asyncio.get_running_loop(), None)
+
+    if clients is not None:
+        es_async, claude_async = clients
+        await es_async.close()
+        await claude_async.close()
+
+
+def run_async(coro):
+    """
+    Run a coroutine on the shared background event loop and block until it finishes.
+
+    Lets synchronous callers such as Streamlit reruns share one loop, and therefore one set
+    of async connections, instead of paying for a new loop per call.
+    """
+    global background_loop
+
+    with async_clients_lock:
+        if background_loop is None:
+            background_loop = asyncio.new_event_loop()
+            threading.Thread(target=background_loop.run_forever, daemon=True).start()
+
+    return asyncio.run_coroutine_threadsafe(coro, background_loop).result()
+
+
+async def timed_search_async(es_async, index_name, body, timeout=None):
+    start_time = time.time()
+
+    if timeout is not None:
+        es_async = es_async.options(request_timeout=timeout)
+
+    response = await es_async.search(index=index_name, body=body)
+
+    return response['hits']['hits'], time.time() - start_time
+
+
+async def run_leg_async(leg, es_async, index_name, body, timeout=None):
+    """Async run_leg: through the leg's circuit breaker, hedged when slow; returns (hits, seconds, error)."""
+    def search():
+        return timed_search_async(es_async, index_name, body, timeout)
+
+    def hedged_search():
+        return get_hedger(f"es.{leg}").call_async(search, timeout)
+
+    start_time = time.time()
+
+    try:
+        hits, _ = await get_breaker(f"es.{leg}").call_async(hedged_search if SEARCH_HEDGING else search)
+    except Exception as e:
+        return None, None, e
+
+    return hits, time.time() - start_time, None
+
+
+async def encode_async(query):
+    # to_thread copies the context, so the embed span still lands in the caller's trace
+    return await asyncio.to_thread(encode_query, query)
+
+
+async def elastic_search_hybrid_rrf_async(field, query, vector=None, k=60, index_name=INDEX_NAME,
+                                          timings=None):
+    """
+    Async version of elastic_search_hybrid_rrf with both legs in flight at once.
+
+    When `vector` is None the query is encoded here while the keyword leg, which
+    doesn't need it, is already running. Deadlines, breakers, hedging and the
+    one-leg fallback work as in elastic_search_hybrid_rrf.
+    """
+    if timings is None:
+        timings = {}
+
+    es_async, _ = get_async_clients()
+    timeout = stage_timeout("search")
+    start_time = time.time()
+
+    keyword_task = asyncio.create_task(
+        run_leg_async("keyword", es_async, index_name, build_keyword_query(query), timeout)
+    )
+
+    try:
+        if vector is None:
+            vector = await encode_async(query)
+            timings['encode'] = time.time() - start_time
+
+        knn_outcome = await run_leg_async("knn", es_async, index_name, build_knn_query(field, vector), timeout)
+    except BaseException:
+        keyword_task.cancel()
+        raise
+
+    knn_results, keyword_results = surviving_legs(knn_outcome, await keyword_task, timings)
+    timings['round_trip'] = time.time() - start_time
+    record_search_timings(timings)
+
+    top_ids, sources, rrf_scores, leg_ranks = fuse_results(knn_results, keyword_results, k)
+    missing_ids = [doc_id for doc_id in top_ids if doc_id not in sources]
+
+    if missing_ids:
+        fetch_client = es_async if timeout is None else es_async.options(request_timeout=timeout)
+
+        with span("search.fetch"):
+            fetched = await fetch_client.mget(index=index_name, ids=missing_ids, source=SOURCE_FIELDS)
+        add_fetched_sources(sources, fetched['docs'])
+
+    return [fused_result(sources[doc_id], doc_id, rrf_scores, leg_ranks) for doc_id in top_ids if doc_id in sources]
+
+
+async def llm_async(prompt, model_choice, system=None, timeout=None, breaker=None):
+    """Async llm, sharing its circuit breakers."""
+    start_time = time.time()
+
+    _, claude_async = get_async_clients()
+    params = message_params(prompt, model_choice, system)
+
+    messages = claude_messages(claude_async, timeout)
+    response = await get_claude_breaker(breaker or model_choice).call_async(messages.create, **params)
+
+    return response.content[0].text, usage_tokens(response.usage), time.time() - start_time
+
+
+async def evaluate_relevance_async(question, answer, timeout=None):
+    prompt = EVALUATION_PROMPT_TEMPLATE.format(question=question, answer=answer)
+
+    with span("evaluation"):
+        evaluation, tokens, _ = await llm_async(prompt, 'claude/3-haiku', timeout=timeout, breaker="judge")
+
+    return parse_evaluation(evaluation, tokens)
+
+
+async def judge_answer_async(question, answer):
+    """Async judge_answer: skipped (UNKNOWN) when the judge is unavailable or out of time."""
+    try:
+        return await evaluate_relevance_async(question, answer, stage_timeout("evaluation"))
+    except CLAUDE_UNAVAILABLE_ERRORS + (CircuitOpenError, DeadlineExceeded) as e:
+        metrics.increment("rag_evaluations_skipped_total", reason=type(e).__name__)
+
+        return "UNKNOWN", f"Evaluation skipped: {type(e).__name__}", NO_TOKENS
+
+
+async def answer_with_fallback_async(prompt, model_choice, model_fallback=True):
+    try:
+        return model_choice, await llm_async(prompt, model_choice, SYSTEM_PROMPT, stage_timeout("llm"))
+    except CLAUDE_UNAVAILABLE_ERRORS + (CircuitOpenError,) as e:
+        if model_choice == 'claude/3-haiku' or not model_fallback:
+            raise
+
+        model_choice = fall_back_to_haiku(model_choice, e)
+
+        return model_choice, await llm_async(prompt, model_choice, SYSTEM_PROMPT, stage_timeout("llm"))
+
+
+async def get_answer_async(query, model_choice, defer_evaluation=False, model_fallback=True):
+    """Async counterpart of get_answer; returns the same dict."""
+    # each call runs in its own task, so the trace and the deadline don't leak between concurrent answers
+    with trace() as stage_timings, span("total"), deadline():
+        return await answer_query_async(query, model_choice, defer_evaluation, stage_timings, model_fallback)
+
+
+async def answer_query_async(query, model_choice, defer_evaluation, stage_timings, model_fallback=True):
+    start_time = time.perf_counter()
+    vector = None
+
+    if get_answer_cache() is not None:
+        # the cache lookup needs the vector first, so encoding can't overlap the keyword leg here
+        vector = await encode_async(query)
+        cached_answer = get_cached_answer(vector)
+
+        if cached_answer is not None:
+            cached_answer['stage_timings'] = stage_timings
+            return cached_answer
+
+    retrieval_timings = {}
+
+    with span("search"):
+        if RETRIEVAL_BACKEND == "local":
+            if vector is None:
+                vector = await encode_async(query)
+
+            search_results = local_search_hybrid_rrf('page_content_vector', query, vector, timings=retrieval_timings)
+        else:
+            search_results = await elastic_search_hybrid_rrf_async(
+                'page_content_vector', query, vector, timings=retrieval_timings
+            )
+
+    with span("prompt"):
+        prompt = build_prompt(query, search_results)
+
+    model_choice, routing_decision = route_model(
+        query, model_choice, search_results, prompt, time.perf_counter() - start_time
+    )
+
+    with span("llm"):
+        model_choice, (answer, tokens, response_time) = await answer_with_fallback_async(
+            prompt, model_choice, model_fallback
+        )
+
+    observe_answer(model_choice, response_time, tokens)
+
+    if defer_evaluation:
+        relevance, explanation, eval_tokens = PENDING_RELEVANCE, "", NO_TOKENS
+    else:
+        relevance, explanation, eval_tokens = await judge_answer_async(query, answer)
+        remember_answer(query, answer, model_choice, relevance, explanation, vector)
+
+    return build_answer_data(answer, response_time, relevance, explanation, model_choice,
+                             tokens, eval_tokens, retrieval_timings, stage_timings=stage_timings,
+                             routing_decision=routing_decision)
+
+
+async def get_answers_async(queries, model_choice, concurrency=8):
+    """
+    Answer many questions concurrently, keeping at most `concurrency` pipelines in flight.
+
+    Returns one entry per question, in order: its answer data, or the exception it raised,
+    so one failing question neither loses the other answers nor cuts their pipelines short.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer_one(query):
+        async with semaphore:
+            return await get_answer_async(query, model_choice)
+
+    return await asyncio.gather(*(answer_one(query) for query in queries), return_exceptions=True)
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import json
+import time
+import pandas as pd
+
+from assistant import get_answers_async, close_async_clients
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Answer a CSV of questions with the async RAG pipeline")
+    parser.add_argument("questions", help="CSV file with a 'question' column")
+    parser.add_argument("--output", default="answers.jsonl", help="where to write one JSON answer per line")
+    parser.add_argument("--model", default="claude/3-haiku", help="model choice, as in the app sidebar")
+    parser.add_argument("--concurrency", type=int, default=8, help="questions in flight at once")
+    parser.add_argument("--limit", type=int, default=None, help="only answer the first N questions")
+
+    return parser.parse_args()
+
+
+def error_record(error):
+    # written in place of the answer, so the output still has one line per question
+    return {"error": type(error).__name__, "error_message": str(error)}
+
+
+async def run_batch(questions, model_choice, concurrency):
+    try:
+        return await get_answers_async(questions, model_choice, concurrency=concurrency)
+    finally:
+        await close_async_clients()
+
+
+def main():
+    args = parse_args()
+
+    questions = pd.read_csv(args.questions)["question"].tolist()
+
+    if args.limit is not None:
+        questions = questions[:args.limit]
+
+    print(f"Answering {len(questions)} questions with {args.model} (concurrency {args.concurrency})...")
+
+    start_time = time.time()
+    answers = asyncio.run(run_batch(questions, args.model, args.concurrency))
+    elapsed = time.time() - start_time
+
+    failed = 0
+
+    with open(args.output, "w") as f_out:
+        for question, answer_data in zip(questions, answers):
+            if isinstance(answer_data, BaseException):
+                failed += 1
+                answer_data = error_record(answer_data)
+
+            f_out.write(json.dumps({"question": question, **answer_data}) + "\n")
+
+    print(f"Answered {len(answers) - failed} questions in {elapsed:.2f} seconds "
+          f"({len(answers) / elapsed:.2f} questions/sec), {failed} failed")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
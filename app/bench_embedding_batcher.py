@@ -0,0 +1,57 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from benchmark import GROUND_TRUTH_PATH
+from embedding_batcher import EmbeddingBatcher
+from embeddings import MODEL_NAME, load_encoder
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query encode throughput with and without micro-batching")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH, help="CSV with a 'question' column")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="comma-separated caller thread counts")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=500, help="questions encoded per run")
+
+    return parser.parse_args()
+
+
+def run(encode, questions, concurrency):
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(encode, questions))
+
+    return len(questions) / (time.perf_counter() - start_time)
+
+
+def main():
+    args = parse_args()
+
+    questions = pd.read_csv(args.ground_truth)["question"].tolist()[:args.limit]
+    model = load_encoder(args.model)
+    model.encode("warm up")
+
+    print(f"{'callers':>8} {'direct q/s':>11} {'batched q/s':>12} {'mean batch':>11} {'queue p99 ms':>13}")
+
+    for concurrency in [int(value) for value in args.concurrency.split(",")]:
+        direct = run(model.encode, questions, concurrency)
+
+        batcher = EmbeddingBatcher(
+            lambda queries: model.encode(queries, batch_size=args.max_batch),
+            max_wait=args.max_wait_ms / 1000, max_batch=args.max_batch,
+        )
+        batched = run(batcher.encode, questions, concurrency)
+        stats = batcher.get_stats()
+
+        print(f"{concurrency:>8} {direct:>11.1f} {batched:>12.1f} "
+              f"{stats['batch_size_mean']:>11.1f} {stats['queue_delay_ms_p99']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from sentence_transformers import SentenceTransformer
+
+from embedding_cache import QueryEmbeddingCache
+
+GROUND_TRUTH_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "ground-truth-retrieval.csv")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure encode time saved by the query embedding cache")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH, help="CSV with a 'question' column")
+    parser.add_argument("--model", default=os.getenv("MODEL_NAME", "multi-qa-MiniLM-L6-cos-v1"))
+    parser.add_argument("--passes", type=int, default=3, help="times the question log is replayed")
+    parser.add_argument("--cache-size", type=int, default=1024)
+
+    return parser.parse_args()
+
+
+def replay(encode, questions, passes):
+    start_time = time.perf_counter()
+
+    for _ in range(passes):
+        for question in questions:
+            encode(question)
+
+    return time.perf_counter() - start_time
+
+
+def main():
+    args = parse_args()
+
+    questions = pd.read_csv(args.ground_truth)["question"].tolist()
+    model = SentenceTransformer(args.model)
+    model.encode("warm up")
+
+    total = len(questions) * args.passes
+    print(f"Replaying {len(questions)} questions x {args.passes} passes ({total} encodes)")
+
+    uncached_time = replay(model.encode, questions, args.passes)
+    print(f"uncached:        {uncached_time:.2f}s ({uncached_time / total * 1000:.2f} ms/query)")
+
+    memory_cache = QueryEmbeddingCache(model.encode, max_size=args.cache_size)
+    memory_time = replay(memory_cache.encode, questions, args.passes)
+    print(f"memory cache:    {memory_time:.2f}s ({memory_time / total * 1000:.2f} ms/query) "
+          f"saved {uncached_time - memory_time:.2f}s, stats {memory_cache.get_stats()}")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        replay(QueryEmbeddingCache(model.encode, max_size=args.cache_size, path=cache_dir).encode, questions, 1)
+
+        # a fresh cache on the same directory simulates a restart: the first pass is served from disk
+        restarted_cache = QueryEmbeddingCache(model.encode, max_size=args.cache_size, path=cache_dir)
+        restart_time = replay(restarted_cache.encode, questions, args.passes)
+        print(f"after restart:   {restart_time:.2f}s ({restart_time / total * 1000:.2f} ms/query) "
+              f"saved {uncached_time - restart_time:.2f}s, stats {restarted_cache.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import assistant
+from benchmark import GROUND_TRUTH_PATH, evaluate
+from embeddings import MODEL_NAME, load_encoder
+from local_search import LocalIndex, normalize_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the ONNX embedding backend with PyTorch: parity and speed")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--documents", default=assistant.LOCAL_DOCUMENTS_PATH)
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads, 0 for all cores")
+    parser.add_argument("--fp32", action="store_true", help="run the unquantized ONNX export")
+    parser.add_argument("--queries", type=int, default=200, help="questions timed one at a time")
+
+    return parser.parse_args()
+
+
+def time_encode(encoder, contents, batch_size):
+    start_time = time.perf_counter()
+    vectors = normalize_rows(np.asarray(encoder.encode(contents, batch_size=batch_size), dtype=np.float32))
+
+    return vectors, time.perf_counter() - start_time
+
+
+def time_single_queries(encoder, questions):
+    latencies = []
+
+    for question in questions:
+        start_time = time.perf_counter()
+        encoder.encode(question)
+        latencies.append(time.perf_counter() - start_time)
+
+    return np.array(latencies) * 1000
+
+
+def retrieval_quality(documents, doc_vectors, question_vectors, ground_truth):
+    """Hit rate and MRR for kNN alone and for the hybrid RRF search, on an in-process index."""
+    index = LocalIndex(documents, doc_vectors)
+    assistant.set_singleton('local_index', index)
+
+    def knn(q):
+        return [hit['_source'] for hit in index.knn_hits(question_vectors[q['question']], size=5)]
+
+    def hybrid(q):
+        return assistant.local_search_hybrid_rrf("page_content_vector", q['question'], question_vectors[q['question']])
+
+    return {
+        'knn': evaluate(ground_truth, knn, workers=1),
+        'hybrid': evaluate(ground_truth, hybrid, workers=1),
+    }
+
+
+def main():
+    args = parse_args()
+
+    with open(args.documents) as f_in:
+        documents = json.load(f_in)
+
+    ground_truth = pd.read_csv(args.ground_truth).to_dict(orient="records")
+    contents = [doc['page_content'] for doc in documents]
+    questions = sorted({q['question'] for q in ground_truth})
+
+    backends = {
+        'torch': load_encoder(args.model, backend="torch"),
+        'onnx': load_encoder(args.model, backend="onnx", quantized=not args.fp32, threads=args.threads),
+    }
+    results = {}
+
+    for name, encoder in backends.items():
+        encoder.encode("warm up")
+
+        doc_vectors, doc_time = time_encode(encoder, contents, args.batch_size)
+        question_vectors, _ = time_encode(encoder, questions, args.batch_size)
+        latencies = time_single_queries(encoder, questions[:args.queries])
+
+        results[name] = {
+            'doc_vectors': doc_vectors,
+            'question_vectors': question_vectors,
+            'retrieval': retrieval_quality(documents, doc_vectors, dict(zip(questions, question_vectors)), ground_truth),
+        }
+
+        print(f"{name}: {len(contents) / doc_time:.1f} docs/sec, single query "
+              f"p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms")
+
+    print("\nCosine agreement between backends:")
+
+    for kind in ("doc_vectors", "question_vectors"):
+        cosines = (results['torch'][kind] * results['onnx'][kind]).sum(axis=1)
+        print(f"  {kind:<17} mean {cosines.mean():.4f}  min {cosines.min():.4f}")
+
+    print("\nRetrieval on the ground-truth set:")
+
+    for search in ("knn", "hybrid"):
+        for name in backends:
+            metrics = results[name]['retrieval'][search]
+            print(f"  {search:<7} {name:<6} hit_rate {metrics['hit_rate']:.4f}  mrr {metrics['mrr']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+# runs in a fresh interpreter so every measurement is a true cold start
+CHILD_SCRIPT = """
+import json, sys, time
+
+start_time = time.perf_counter()
+import assistant
+import_time = time.perf_counter() - start_time
+
+warm_up, question, full, model_choice = sys.argv[1] == "1", sys.argv[2], sys.argv[3] == "1", sys.argv[4]
+warm_up_time = assistant.warm_up() if warm_up else 0.0
+
+
+def request():
+    start_time = time.perf_counter()
+
+    if full:
+        assistant.get_answer(question, model_choice)
+    else:
+        assistant.hybrid_search("page_content_vector", question, assistant.encode_query(question))
+
+    return time.perf_counter() - start_time
+
+
+first_request = request()
+second_request = request()
+
+print(json.dumps({
+    'import_s': import_time,
+    'warm_up_s': warm_up_time,
+    'first_request_s': first_request,
+    'second_request_s': second_request,
+}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure cold-start cost: import, warm-up and first request latency")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes to start")
+    parser.add_argument("--question", default="How do I join a project team?")
+    parser.add_argument("--no-warm-up", action="store_true", help="skip warm_up() so the first request pays for it")
+    parser.add_argument("--full", action="store_true", help="time get_answer instead of retrieval only (calls Claude)")
+    parser.add_argument("--model-choice", default="claude/3-haiku")
+
+    return parser.parse_args()
+
+
+def run_once(args):
+    command = [
+        sys.executable, "-c", CHILD_SCRIPT,
+        "0" if args.no_warm_up else "1", args.question, "1" if args.full else "0", args.model_choice,
+    ]
+    completed = subprocess.run(
+        command, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    )
+
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+
+    runs = [run_once(args) for _ in range(args.runs)]
+
+    for key in runs[0]:
+        values = np.array([run[key] for run in runs])
+        print(f"{key:<18} mean {values.mean():.3f}s  min {values.min():.3f}s  max {values.max():.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import assistant
+
+GROUND_TRUTH_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "ground-truth-retrieval.csv")
+
+
+def hit_rate(relevance_total):
+    cnt = 0
+
+    for line in relevance_total:
+        if True in line:
+            cnt = cnt + 1
+
+    return cnt / len(relevance_total)
+
+
+def mrr(relevance_total):
+    total_score = 0.0
+
+    for line in relevance_total:
+        for rank in range(len(line)):
+            if line[rank] == True:
+                total_score = total_score + 1 / (rank + 1)
+
+    return total_score / len(relevance_total)
+
+
+def evaluate(ground_truth, search_function, workers=8):
+    """
+    Run every ground-truth question through `search_function` on a pool of `workers` threads.
+
+    `search_function` takes a ground-truth record and returns documents with an 'id'.
+    Returns hit rate and MRR along with latency percentiles and throughput.
+    """
+
+    def run_one(q):
+        start_time = time.perf_counter()
+        results = search_function(q)
+        latency = time.perf_counter() - start_time
+
+        # relevance is matching the id from the questions to the id in the documents
+        return [d['id'] == q['id'] for d in results], latency
+
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(run_one, ground_truth))
+
+    wall_time = time.perf_counter() - start_time
+
+    relevance_total = [relevance for relevance, _ in outcomes]
+    latencies = np.array([latency for _, latency in outcomes]) * 1000
+
+    return {
+        'hit_rate': hit_rate(relevance_total),
+        'mrr': mrr(relevance_total),
+        'queries': len(ground_truth),
+        'workers': workers,
+        'latency_ms_mean': float(latencies.mean()),
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p95': float(np.percentile(latencies, 95)),
+        'latency_ms_p99': float(np.percentile(latencies, 99)),
+        'wall_time_s': wall_time,
+        'throughput_qps': len(ground_truth) / wall_time,
+    }
+
+
+def make_search_function(args, vectors):
+    keyword_fields = args.keyword_fields.split(",") if args.keyword_fields else None
+
+    if args.backend == "local":
+        if keyword_fields:
+            raise ValueError("--keyword-fields only applies to the elasticsearch backend")
+
+        assistant.get_local_index()
+
+        def search(q):
+            return assistant.local_search_hybrid_rrf(args.field, q['question'], vectors[q['question']], k=args.k)
+    else:
+        def search(q):
+            return assistant.elastic_search_hybrid_rrf(
+                args.field, q['question'], vectors[q['question']], k=args.k,
+                mode=args.mode, keyword_fields=keyword_fields,
+            )
+
+    return search
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f_in:
+        baseline = json.load(f_in)['metrics']
+
+    print(f"Compared with {baseline_path}:")
+
+    for key, value in results.items():
+        if key in baseline and isinstance(value, float):
+            print(f"  {key:<16} {baseline[key]:>10.4f} -> {value:>10.4f} ({value - baseline[key]:+.4f})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency on the ground-truth set")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH)
+    parser.add_argument("--backend", choices=["elasticsearch", "local"], default=assistant.RETRIEVAL_BACKEND)
+    parser.add_argument("--mode", choices=["sequential", "msearch", "concurrent"], default=assistant.RETRIEVAL_MODE,
+                        help="how the two Elasticsearch legs are sent")
+    parser.add_argument("--field", default="page_content_vector", help="vector field for the kNN leg")
+    parser.add_argument("--k", type=int, default=60, help="RRF rank constant")
+    parser.add_argument("--keyword-fields", default=None,
+                        help="comma-separated multi_match fields with boosts, e.g. 'page_content^3,header_1'")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N questions")
+    parser.add_argument("--output", default=None, help="write the results as JSON here")
+    parser.add_argument("--baseline", default=None, help="earlier --output file to compare against")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    ground_truth = pd.read_csv(args.ground_truth).to_dict(orient="records")
+
+    if args.limit is not None:
+        ground_truth = ground_truth[:args.limit]
+
+    # encoding happens up front so the timings cover retrieval only
+    questions = sorted({q['question'] for q in ground_truth})
+    vectors = dict(zip(questions, assistant.get_model().encode(questions, batch_size=64)))
+
+    search_function = make_search_function(args, vectors)
+    results = evaluate(ground_truth, search_function, workers=args.workers)
+
+    for key, value in results.items():
+        print(f"{key:<16} {value:.4f}" if isinstance(value, float) else f"{key:<16} {value}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+
+        with open(args.output, "w") as f_out:
+            json.dump({'timestamp': time.time(), 'config': config, 'metrics': results}, f_out, indent=4)
+
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
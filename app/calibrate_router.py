@@ -0,0 +1,74 @@
+import argparse
+
+import pandas as pd
+
+import assistant
+from benchmark import GROUND_TRUTH_PATH
+from router import ROUTER_CONFIDENCE_THRESHOLD, retrieval_confidence
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure how well retrieval_confidence predicts a correct top document on the ground-truth set"
+    )
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH)
+    parser.add_argument("--target-precision", type=float, default=0.9,
+                        help="share of confident retrievals whose top document must be the right one")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N questions")
+
+    return parser.parse_args()
+
+
+def measure(ground_truth, vectors):
+    """(confidence, top document is the ground-truth one) per question, on RETRIEVAL_BACKEND."""
+    outcomes = []
+
+    for q in ground_truth:
+        results = assistant.hybrid_search('page_content_vector', q['question'], vectors[q['question']])
+        correct = bool(results) and results[0]['id'] == q['id']
+        outcomes.append((retrieval_confidence(results), correct))
+
+    return outcomes
+
+
+def main():
+    args = parse_args()
+
+    ground_truth = pd.read_csv(args.ground_truth).to_dict(orient="records")
+
+    if args.limit is not None:
+        ground_truth = ground_truth[:args.limit]
+
+    questions = sorted({q['question'] for q in ground_truth})
+    vectors = dict(zip(questions, assistant.get_model().encode(questions, batch_size=64)))
+
+    outcomes = measure(ground_truth, vectors)
+    top1 = sum(correct for _, correct in outcomes) / len(outcomes)
+
+    print(f"{len(outcomes)} questions on {assistant.RETRIEVAL_BACKEND}, top-1 accuracy {top1:.3f}")
+    print(f"{'threshold':>9} {'confident':>9} {'precision':>9} {'rest top-1':>10}")
+
+    recommended = None
+
+    # confidence takes few distinct values, so every one of them is a candidate threshold
+    for threshold in sorted({confidence for confidence, _ in outcomes}, reverse=True):
+        confident = [correct for confidence, correct in outcomes if confidence >= threshold]
+        rest = [correct for confidence, correct in outcomes if confidence < threshold]
+        precision = sum(confident) / len(confident)
+        rest_top1 = sum(rest) / len(rest) if rest else float("nan")
+
+        print(f"{threshold:>9.3f} {len(confident) / len(outcomes):>9.3f} {precision:>9.3f} {rest_top1:>10.3f}")
+
+        if precision >= args.target_precision:
+            recommended = threshold
+
+    print(f"current ROUTER_CONFIDENCE_THRESHOLD={ROUTER_CONFIDENCE_THRESHOLD}")
+
+    if recommended is None:
+        print(f"no threshold reaches precision {args.target_precision}")
+    else:
+        print(f"lowest threshold with precision >= {args.target_precision}: {recommended:.3f}")
+
+
+if __name__ == "__main__":
+    main()
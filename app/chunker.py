@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import re
+import uuid
+
+
+# sections longer than this are split at line boundaries, repeating up to CHUNK_OVERLAP_CHARS
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "4000"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP_CHARS", "200"))
+
+HEADER_PATTERN = re.compile(r"^(#{1,5})\s+(.*?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+# fixed namespace so the same chunk always gets the same uuid5 id
+CHUNK_NAMESPACE = uuid.UUID("6f1c3a52-8d0e-4f57-9b7a-2e4c1d9a0b63")
+
+
+def chunk_id(chunk):
+    """Content-derived id: the same headers, text and source always map to the same id."""
+    fields = {key: value for key, value in chunk.items() if key != "id"}
+
+    return str(uuid.uuid5(CHUNK_NAMESPACE, json.dumps(fields, sort_keys=True)))
+
+
+def make_chunk(lines, headers, source=None):
+    # blank lines become "  \n" paragraph breaks, as in the notebook's MarkdownHeaderTextSplitter
+    # output; inside code fences they are kept as they are
+    paragraphs, current = [], []
+
+    for line, fenced in lines:
+        if line.strip() or (fenced and current):
+            current.append(line.strip())
+        elif current:
+            paragraphs.append("\n".join(current))
+            current = []
+
+    if current:
+        paragraphs.append("\n".join(current))
+
+    if not paragraphs:
+        return None
+
+    chunk = {'page_content': "  \n".join(paragraphs)}
+
+    for level in sorted(headers):
+        chunk[f"header_{level}"] = headers[level]
+
+    if source is not None:
+        chunk['source'] = source
+
+    return {'id': chunk_id(chunk), **chunk}
+
+
+def split_section(lines, max_chars, overlap_chars):
+    """Take the leading (line, fenced) pairs that fit in max_chars; return them and the rest, led by the overlap."""
+    size, cut = 0, 0
+
+    while cut < len(lines) and (cut == 0 or size + len(lines[cut][0]) + 1 <= max_chars):
+        size += len(lines[cut][0]) + 1
+        cut += 1
+
+    piece = lines[:cut]
+    overlap, overlap_size = [], 0
+
+    # whole trailing lines only, and never the entire piece, so the split always makes progress
+    for line in reversed(piece[1:]):
+        if overlap_size + len(line[0]) + 1 > overlap_chars:
+            break
+
+        overlap.insert(0, line)
+        overlap_size += len(line[0]) + 1
+
+    return piece, overlap + lines[cut:]
+
+
+def chunk_lines(lines, source=None, max_chars=CHUNK_MAX_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS):
+    """
+    Split markdown, given as an iterable of lines, into chunks under header_1..header_5.
+
+    Chunks are yielded as soon as their section ends or grows past `max_chars`, so only
+    one section is held in memory. Headers inside fenced code blocks are treated as text.
+    """
+    headers = {}
+    section = []
+    size = 0
+    fence = None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        fence_match = FENCE_PATTERN.match(line)
+        fenced = fence is not None
+
+        if fence_match:
+            if fence is None:
+                fence = fence_match.group(1)
+            elif fence_match.group(1) == fence:
+                fence = None
+        elif fence is None:
+            header_match = HEADER_PATTERN.match(line)
+
+            if header_match:
+                chunk = make_chunk(section, headers, source)
+
+                if chunk is not None:
+                    yield chunk
+
+                level = len(header_match.group(1))
+                headers = {key: value for key, value in headers.items() if key < level}
+                headers[level] = header_match.group(2)
+                section, size = [], 0
+
+                continue
+
+        section.append((line, fenced))
+        size += len(line) + 1
+
+        while size > max_chars and len(section) > 1:
+            piece, section = split_section(section, max_chars, overlap_chars)
+            size = sum(len(text) + 1 for text, _ in section)
+            chunk = make_chunk(piece, headers, source)
+
+            if chunk is not None:
+                yield chunk
+
+    chunk = make_chunk(section, headers, source)
+
+    if chunk is not None:
+        yield chunk
+
+
+def markdown_files(paths):
+    """Expand files and directories (searched recursively for .md files) in a stable order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+
+                for name in sorted(files):
+                    if name.lower().endswith(".md"):
+                        file_path = os.path.join(root, name)
+                        yield file_path, os.path.relpath(file_path, path)
+        else:
+            yield path, os.path.basename(path)
+
+
+def chunk_paths(paths, **kwargs):
+    """Chunk every markdown file under `paths`, reading each one line by line."""
+    for file_path, source in markdown_files(paths):
+        with open(file_path, encoding="utf-8") as f_in:
+            yield from chunk_lines(f_in, source=source, **kwargs)
+
+
+def changed_chunks(old_chunks, new_chunks, removed_ids=None):
+    """
+    Yield the chunks of `new_chunks` that aren't in `old_chunks`, i.e. new or edited sections.
+
+    Since ids are content-derived, only the old ids are kept in memory. Pass a list as
+    `removed_ids` to receive the ids of old chunks that no longer exist once the
+    generator is exhausted.
+    """
+    old_ids = {chunk['id'] for chunk in old_chunks}
+    seen_ids = set()
+
+    for chunk in new_chunks:
+        seen_ids.add(chunk['id'])
+
+        if chunk['id'] not in old_ids:
+            yield chunk
+
+    if removed_ids is not None:
+        removed_ids.extend(sorted(old_ids - seen_ids))
+
+
+def write_documents(chunks, path):
+    """Write chunks as a JSON array one at a time, without building the list first."""
+    count = 0
+
+    with open(path, "w", encoding="utf-8") as f_out:
+        f_out.write("[")
+
+        for chunk in chunks:
+            f_out.write(",\n" if count else "\n")
+            f_out.write(json.dumps(chunk, ensure_ascii=False))
+            count += 1
+
+        f_out.write("\n]\n")
+
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chunk markdown files into documents.json")
+    parser.add_argument("paths", nargs="+", help="markdown files or directories")
+    parser.add_argument("--output", default="documents.json")
+    parser.add_argument("--previous", nargs="+", default=None,
+                        help="the old version, with the same file names; only new or changed chunks are written")
+    parser.add_argument("--max-chars", type=int, default=CHUNK_MAX_CHARS)
+    parser.add_argument("--overlap-chars", type=int, default=CHUNK_OVERLAP_CHARS)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    options = {'max_chars': args.max_chars, 'overlap_chars': args.overlap_chars}
+
+    chunks = chunk_paths(args.paths, **options)
+    removed_ids = []
+
+    if args.previous:
+        chunks = changed_chunks(chunk_paths(args.previous, **options), chunks, removed_ids)
+
+    count = write_documents(chunks, args.output)
+
+    print(f"Wrote {count} {'changed ' if args.previous else ''}chunks to {args.output}")
+
+    if args.previous:
+        print(f"{len(removed_ids)} chunks were removed: {removed_ids}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,36 @@
 import os
+import json
+import time
+import queue
+import atexit
+import threading
+from collections import deque
+from itertools import groupby
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2 import extensions
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import PoolError
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from tracing import span
 
 tz = ZoneInfo("America/Los_Angeles")
 
+POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "30"))
+# idle connections older than this are pinged before being handed out
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("POSTGRES_POOL_HEALTH_CHECK", "30"))
+
+# queue conversation/feedback writes and flush them in batches off the request path
+WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("DB_WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("DB_WRITE_BEHIND_BATCH_SIZE", "100"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("DB_WRITE_BEHIND_INTERVAL", "1.0"))
+
+# errors worth retrying a whole batch for; anything else is blamed on the rows themselves
+TRANSIENT_DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
 
 def get_db_connection():
     return psycopg2.connect(
@@ -16,111 +41,740 @@ def get_db_connection():
     )
 
 
-def init_db():
-    conn = get_db_connection()
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by the whole process.
+
+    Checkouts block (up to `checkout_timeout`) when `max_size` connections are in use.
+    Idle connections are health-checked before being handed out and replaced when
+    they are closed or fail the check; connections returned closed are discarded.
+    """
+
+    def __init__(self, connect, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, health_check_interval=POOL_HEALTH_CHECK_INTERVAL):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        self.cond = threading.Condition()
+        self.idle = deque()
+        self.size = 0
+        self.in_use = 0
+        self.stats = {
+            'checkouts': 0, 'waits': 0, 'wait_time': 0.0, 'max_wait_time': 0.0,
+            'timeouts': 0, 'created': 0, 'reconnects': 0, 'discarded': 0,
+        }
+
+        for _ in range(min_size):
+            self.idle.append((self._new_connection(), time.time()))
+            self.size += 1
+
+    def getconn(self):
+        start_time = time.time()
+        waited = False
+
+        with self.cond:
+            while not self.idle and self.size >= self.max_size:
+                waited = True
+                remaining = self.checkout_timeout - (time.time() - start_time)
+
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    if not self.idle and self.size >= self.max_size:
+                        self.stats['timeouts'] += 1
+                        raise PoolError(f"no connection available after {self.checkout_timeout}s")
+
+            if self.idle:
+                conn, last_used = self.idle.pop()
+            else:
+                conn, last_used = None, None
+                self.size += 1
+
+            self.in_use += 1
+            self.stats['checkouts'] += 1
+
+            if waited:
+                wait_time = time.time() - start_time
+                self.stats['waits'] += 1
+                self.stats['wait_time'] += wait_time
+                self.stats['max_wait_time'] = max(self.stats['max_wait_time'], wait_time)
+
+        try:
+            if conn is None:
+                conn = self._new_connection()
+            elif not self._is_healthy(conn, last_used):
+                self._close(conn)
+                conn = self._new_connection()
+
+                with self.cond:
+                    self.stats['reconnects'] += 1
+        except Exception:
+            with self.cond:
+                self.size -= 1
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection, rolling back any open transaction; broken connections are dropped."""
+        healthy = not conn.closed
+
+        if healthy and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+
+        with self.cond:
+            self.in_use -= 1
+
+            if healthy:
+                self.idle.append((conn, time.time()))
+            else:
+                self.size -= 1
+                self.stats['discarded'] += 1
+
+            self.cond.notify()
+
+        if not healthy:
+            self._close(conn)
+
+    def closeall(self):
+        with self.cond:
+            idle, self.idle = list(self.idle), deque()
+            self.size -= len(idle)
+
+        for conn, _ in idle:
+            self._close(conn)
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                **self.stats,
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'max_size': self.max_size,
+            }
+
+    def _new_connection(self):
+        conn = self.connect()
+
+        with self.cond:
+            self.stats['created'] += 1
+
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+
+        if time.time() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+
+            conn.rollback()
+
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, opening it on first use."""
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool(get_db_connection)
+            atexit.register(pool.closeall)
+
+    return pool
+
+
+def get_pool_stats():
+    return get_pool().get_stats()
+
+
+DAILY_STATS_SQL = """
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        day DATE NOT NULL,
+        model_used TEXT NOT NULL,
+        relevance TEXT NOT NULL,
+        conversations INTEGER NOT NULL DEFAULT 0,
+        thumbs_up INTEGER NOT NULL DEFAULT 0,
+        thumbs_down INTEGER NOT NULL DEFAULT 0,
+        prompt_tokens BIGINT NOT NULL DEFAULT 0,
+        completion_tokens BIGINT NOT NULL DEFAULT 0,
+        eval_total_tokens BIGINT NOT NULL DEFAULT 0,
+        claude_cost FLOAT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, model_used, relevance)
+    );
+
+    CREATE OR REPLACE FUNCTION daily_stats_add(
+        p_day DATE, p_model_used TEXT, p_relevance TEXT, p_conversations INTEGER,
+        p_thumbs_up INTEGER, p_thumbs_down INTEGER, p_prompt_tokens BIGINT,
+        p_completion_tokens BIGINT, p_eval_total_tokens BIGINT, p_claude_cost FLOAT
+    ) RETURNS VOID AS $$
+    BEGIN
+        INSERT INTO daily_stats AS d
+            (day, model_used, relevance, conversations, thumbs_up, thumbs_down,
+             prompt_tokens, completion_tokens, eval_total_tokens, claude_cost)
+        VALUES
+            (p_day, p_model_used, p_relevance, p_conversations, p_thumbs_up, p_thumbs_down,
+             p_prompt_tokens, p_completion_tokens, p_eval_total_tokens, p_claude_cost)
+        ON CONFLICT (day, model_used, relevance) DO UPDATE SET
+            conversations = d.conversations + EXCLUDED.conversations,
+            thumbs_up = d.thumbs_up + EXCLUDED.thumbs_up,
+            thumbs_down = d.thumbs_down + EXCLUDED.thumbs_down,
+            prompt_tokens = d.prompt_tokens + EXCLUDED.prompt_tokens,
+            completion_tokens = d.completion_tokens + EXCLUDED.completion_tokens,
+            eval_total_tokens = d.eval_total_tokens + EXCLUDED.eval_total_tokens,
+            claude_cost = d.claude_cost + EXCLUDED.claude_cost;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- an update (e.g. a PENDING conversation being judged) moves the row, and its feedback, between buckets
+    CREATE OR REPLACE FUNCTION conversations_daily_stats() RETURNS TRIGGER AS $$
+    DECLARE
+        up INTEGER := 0;
+        down INTEGER := 0;
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            SELECT COUNT(*) FILTER (WHERE feedback > 0), COUNT(*) FILTER (WHERE feedback < 0)
+            INTO up, down
+            FROM feedback
+            WHERE conversation_id = OLD.id;
+
+            PERFORM daily_stats_add(
+                (OLD.timestamp AT TIME ZONE 'America/Los_Angeles')::date, OLD.model_used, OLD.relevance,
+                -1, -up, -down, -OLD.prompt_tokens, -OLD.completion_tokens, -OLD.eval_total_tokens,
+                -OLD.claude_cost
+            );
+        END IF;
+
+        PERFORM daily_stats_add(
+            (NEW.timestamp AT TIME ZONE 'America/Los_Angeles')::date, NEW.model_used, NEW.relevance,
+            1, up, down, NEW.prompt_tokens, NEW.completion_tokens, NEW.eval_total_tokens, NEW.claude_cost
+        );
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION feedback_daily_stats() RETURNS TRIGGER AS $$
+    DECLARE
+        c conversations%ROWTYPE;
+    BEGIN
+        SELECT * INTO c FROM conversations WHERE id = NEW.conversation_id;
+
+        IF FOUND THEN
+            PERFORM daily_stats_add(
+                (c.timestamp AT TIME ZONE 'America/Los_Angeles')::date, c.model_used, c.relevance, 0,
+                CASE WHEN NEW.feedback > 0 THEN 1 ELSE 0 END,
+                CASE WHEN NEW.feedback < 0 THEN 1 ELSE 0 END,
+                0, 0, 0, 0
+            );
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS conversations_daily_stats ON conversations;
+    CREATE TRIGGER conversations_daily_stats
+        AFTER INSERT OR UPDATE ON conversations
+        FOR EACH ROW EXECUTE FUNCTION conversations_daily_stats();
+
+    DROP TRIGGER IF EXISTS feedback_daily_stats ON feedback;
+    CREATE TRIGGER feedback_daily_stats
+        AFTER INSERT ON feedback
+        FOR EACH ROW EXECUTE FUNCTION feedback_daily_stats();
+"""
+
+
+def create_daily_stats(cur):
+    """Create (or update) the daily rollup table and the triggers that keep it current on every write."""
+    cur.execute(DAILY_STATS_SQL)
+
+
+def rebuild_daily_stats():
+    """Recompute the rollup from the base tables, e.g. after bulk edits that bypassed the triggers."""
+    conn = get_pool().getconn()
 
     try:
         with conn.cursor() as cur:
-            cur.execute("DROP TABLE IF EXISTS feedback")
-            cur.execute("DROP TABLE IF EXISTS conversations")
-
+            cur.execute("DELETE FROM daily_stats")
             cur.execute("""
-                CREATE TABLE conversations (
-                    id TEXT PRIMARY KEY,
-                    question TEXT NOT NULL,
-                    answer TEXT NOT NULL,
-                    model_used TEXT NOT NULL,
-                    response_time FLOAT NOT NULL,
-                    relevance TEXT NOT NULL,
-                    relevance_explanation TEXT NOT NULL,
-                    prompt_tokens INTEGER NOT NULL,
-                    completion_tokens INTEGER NOT NULL,
-                    total_tokens INTEGER NOT NULL,
-                    eval_prompt_tokens INTEGER NOT NULL,
-                    eval_completion_tokens INTEGER NOT NULL,
-                    eval_total_tokens INTEGER NOT NULL,
-                    claude_cost FLOAT NOT NULL,
-                    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-                )
+                INSERT INTO daily_stats
+                    (day, model_used, relevance, conversations, thumbs_up, thumbs_down,
+                     prompt_tokens, completion_tokens, eval_total_tokens, claude_cost)
+                SELECT
+                    (c.timestamp AT TIME ZONE 'America/Los_Angeles')::date,
+                    c.model_used,
+                    c.relevance,
+                    COUNT(*),
+                    COALESCE(SUM(f.thumbs_up), 0),
+                    COALESCE(SUM(f.thumbs_down), 0),
+                    SUM(c.prompt_tokens),
+                    SUM(c.completion_tokens),
+                    SUM(c.eval_total_tokens),
+                    SUM(c.claude_cost)
+                FROM conversations c
+                LEFT JOIN (
+                    SELECT
+                        conversation_id,
+                        COUNT(*) FILTER (WHERE feedback > 0) AS thumbs_up,
+                        COUNT(*) FILTER (WHERE feedback < 0) AS thumbs_down
+                    FROM feedback
+                    GROUP BY conversation_id
+                ) f ON f.conversation_id = c.id
+                GROUP BY 1, 2, 3
             """)
 
-            cur.execute("""
-                CREATE TABLE feedback (
-                    id SERIAL PRIMARY KEY,
-                    conversation_id TEXT REFERENCES conversations(id),
-                    feedback INTEGER NOT NULL,
-                    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-                )
-            """)
+        conn.commit()
+    finally:
+        get_pool().putconn(conn)
+
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        model_used TEXT NOT NULL,
+        response_time FLOAT NOT NULL,
+        relevance TEXT NOT NULL,
+        relevance_explanation TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        total_tokens INTEGER NOT NULL,
+        eval_prompt_tokens INTEGER NOT NULL,
+        eval_completion_tokens INTEGER NOT NULL,
+        eval_total_tokens INTEGER NOT NULL,
+        claude_cost FLOAT NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+
+    -- columns added since the first release; databases created before them get them here
+    ALTER TABLE conversations
+        ADD COLUMN IF NOT EXISTS cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS time_to_first_token FLOAT,
+        ADD COLUMN IF NOT EXISTS generation_time FLOAT,
+        ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+        ADD COLUMN IF NOT EXISTS stage_timings JSONB,
+        ADD COLUMN IF NOT EXISTS routing_decision JSONB;
+
+    CREATE TABLE IF NOT EXISTS feedback (
+        id SERIAL PRIMARY KEY,
+        conversation_id TEXT REFERENCES conversations(id),
+        feedback INTEGER NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations (timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_conversations_relevance ON conversations (relevance, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_feedback_conversation_id ON feedback (conversation_id);
+"""
+
+# any constant will do; it keeps app processes starting together from migrating at the same time
+MIGRATION_LOCK_ID = 4242
+
+
+def migrate_db():
+    """
+    Bring the schema up to date without touching existing rows; safe to run on every start.
+
+    Creates what is missing, adds new columns and (re)defines the daily_stats triggers. When
+    daily_stats didn't exist yet it is filled once from the conversations already stored.
+    """
+    conn = get_pool().getconn()
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            cur.execute("SELECT to_regclass('daily_stats') IS NULL")
+            new_daily_stats = cur.fetchone()[0]
+
+            cur.execute(SCHEMA_SQL)
+            create_daily_stats(cur)
 
         conn.commit()
     finally:
-        conn.close()
+        get_pool().putconn(conn)
 
+    if new_daily_stats:
+        print("Filling daily_stats from the existing conversations...", flush=True)
+        rebuild_daily_stats()
 
-def save_conversation(conversation_id, question, answer_data, timestamp=None):
-    if timestamp is None:
-        timestamp = datetime.now(tz)
-    
-    conn = get_db_connection()
+
+def init_db():
+    """Drop everything and create the schema from scratch."""
+    conn = get_pool().getconn()
 
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO conversations 
-                (id, question, answer, model_used, response_time, relevance, 
-                relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, claude_cost, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    conversation_id,
-                    question,
-                    answer_data["answer"],
-                    answer_data["model_used"],
-                    answer_data["response_time"],
-                    answer_data["relevance"],
-                    answer_data["relevance_explanation"],
-                    answer_data["prompt_tokens"],
-                    answer_data["completion_tokens"],
-                    answer_data["total_tokens"],
-                    answer_data["eval_prompt_tokens"],
-                    answer_data["eval_completion_tokens"],
-                    answer_data["eval_total_tokens"],
-                    answer_data["claude_cost"],
-                    timestamp,
-                )
-            )
+            cur.execute("DROP TABLE IF EXISTS daily_stats")
+            cur.execute("DROP TABLE IF EXISTS feedback")
+            cur.execute("DROP TABLE IF EXISTS conversations")
 
         conn.commit()
     finally:
-        conn.close()
+        get_pool().putconn(conn)
 
+    migrate_db()
+
+
+CONVERSATION_INSERT = """
+    INSERT INTO conversations 
+    (id, question, answer, model_used, response_time, relevance, 
+    relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
+    cache_creation_tokens, cache_read_tokens,
+    eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, claude_cost,
+    time_to_first_token, generation_time, cache_hit, stage_timings, routing_decision, timestamp)
+    VALUES %s
+"""
+
+RELEVANCE_UPDATE = """
+    UPDATE conversations
+    SET relevance = %s,
+        relevance_explanation = %s,
+        eval_prompt_tokens = %s,
+        eval_completion_tokens = %s,
+        eval_total_tokens = %s
+    WHERE id = %s
+"""
+
+FEEDBACK_INSERT = """
+    INSERT INTO feedback (conversation_id, feedback, timestamp)
+    VALUES %s
+"""
+
+
+def conversation_row(conversation_id, question, answer_data, timestamp):
+    return (
+        conversation_id,
+        question,
+        answer_data["answer"],
+        answer_data["model_used"],
+        answer_data["response_time"],
+        answer_data["relevance"],
+        answer_data["relevance_explanation"],
+        answer_data["prompt_tokens"],
+        answer_data["completion_tokens"],
+        answer_data["total_tokens"],
+        answer_data.get("cache_creation_tokens", 0),
+        answer_data.get("cache_read_tokens", 0),
+        answer_data["eval_prompt_tokens"],
+        answer_data["eval_completion_tokens"],
+        answer_data["eval_total_tokens"],
+        answer_data["claude_cost"],
+        answer_data.get("time_to_first_token"),
+        answer_data.get("generation_time"),
+        answer_data.get("cache_hit", False),
+        json.dumps(answer_data.get("stage_timings", {})),
+        # NULL when the model was picked by hand
+        json.dumps(answer_data["routing_decision"]) if answer_data.get("routing_decision") else None,
+        timestamp,
+    )
+
+
+def write_rows(cur, kind, rows):
+    """Write a run of same-kind rows with one statement per run."""
+    if kind == "conversation":
+        execute_values(cur, CONVERSATION_INSERT, rows)
+    elif kind == "feedback":
+        execute_values(cur, FEEDBACK_INSERT, rows)
+    elif kind == "relevance":
+        cur.executemany(RELEVANCE_UPDATE, rows)
+    else:
+        raise ValueError(f"Unknown row kind: {kind}")
+
+
+# called with no arguments once rows have been committed, e.g. to drop cached dashboard queries
+write_listeners = []
 
-def save_feedback(conversation_id, feedback, timestamp=None):
-    if timestamp is None:
-        timestamp = datetime.now(tz)
 
-    conn = get_db_connection()
+def add_write_listener(callback):
+    write_listeners.append(callback)
+
+
+def notify_written():
+    for callback in list(write_listeners):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Write listener failed: {e}", flush=True)
+
+
+def write_now(kind, row):
+    conn = get_pool().getconn()
 
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO feedback (conversation_id, feedback, timestamp)
-                VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
-                """,
-                (conversation_id, feedback, timestamp),
-            )
+            write_rows(cur, kind, [row])
 
         conn.commit()
     finally:
-        conn.close()
+        get_pool().putconn(conn)
+
+    notify_written()
+
+
+def write(kind, row):
+    """Write a row now, or hand it to the write-behind buffer when DB_WRITE_BEHIND is on."""
+    buffer = get_write_behind_buffer()
+
+    if buffer is not None:
+        buffer.put(kind, row)
+    else:
+        write_now(kind, row)
+
+
+def save_conversation(conversation_id, question, answer_data, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now(tz)
+
+    # with write-behind on this only times the enqueue; the insert itself shows up as db.flush
+    with span("db.save_conversation"):
+        write("conversation", conversation_row(conversation_id, question, answer_data, timestamp))
+
+
+def update_relevance(conversation_id, relevance, explanation, eval_tokens):
+    """Store a relevance judgement made after the conversation was saved."""
+    write("relevance", (
+        relevance,
+        explanation,
+        eval_tokens["prompt_tokens"],
+        eval_tokens["completion_tokens"],
+        eval_tokens["total_tokens"],
+        conversation_id,
+    ))
+
+
+def save_feedback(conversation_id, feedback, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now(tz)
+
+    write("feedback", (conversation_id, feedback, timestamp))
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-memory queue of pending writes, flushed in batches by a background thread.
+
+    All kinds of rows share one FIFO queue and one flusher, and each batch is written in
+    queue order inside a single transaction, so a feedback row or relevance update is never
+    written before the conversation it refers to. A batch is flushed when it reaches
+    `batch_size` rows or `flush_interval` seconds after its first row. `put` blocks while the
+    queue is full, pushing back on callers instead of growing memory without bound.
+
+    A batch that fails on a bad row (e.g. a foreign key violation) is written again one row
+    at a time, so only the rows that still fail are dropped.
+    """
+
+    def __init__(self, max_size=WRITE_BEHIND_QUEUE_SIZE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_INTERVAL, max_retries=3, writer=None, on_written=notify_written):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.writer = writer or self._write_batch
+        self.on_written = on_written
+
+        self.queue = queue.Queue(maxsize=max_size)
+        self.lock = threading.Lock()
+        # orders put/flush against close, so nothing is queued behind the STOP marker
+        self.close_lock = threading.Lock()
+        self.closed = False
+        self.stats = {'queued': 0, 'written': 0, 'batches': 0, 'blocked_puts': 0, 'failed_rows': 0}
+
+        self.thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self.thread.start()
+
+    def put(self, kind, row):
+        with self.close_lock:
+            if self.closed:
+                raise RuntimeError("write-behind buffer is closed")
+
+            with self.lock:
+                self.stats['queued'] += 1
+
+                if self.queue.full():
+                    self.stats['blocked_puts'] += 1
+
+            self.queue.put((kind, row))
+
+    def flush(self, timeout=None):
+        """Block until every row queued before this call has been written. Returns False on timeout."""
+        with self.close_lock:
+            if not self.closed:
+                done = threading.Event()
+                self.queue.put((FLUSH, done))
+
+        if self.closed:
+            # close() writes what is left; the rows are in once the flusher has stopped
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Write everything still queued and stop the flusher."""
+        with self.close_lock:
+            if self.closed:
+                return
+
+            self.closed = True
+            self.queue.put((STOP, None))
+
+        self.thread.join(timeout)
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'pending': self.queue.qsize()}
+
+    def _run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+
+            try:
+                kind, row = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, row = None, None
+
+            if kind not in (None, FLUSH, STOP):
+                batch.append((kind, row))
+
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                self._flush_batch(batch)
+                batch = []
+
+            deadline = None
+
+            if kind == FLUSH:
+                row.set()
+            elif kind == STOP:
+                return
+
+    def _flush_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.writer(batch)
+            except TRANSIENT_DB_ERRORS as e:
+                print(f"Write-behind flush of {len(batch)} rows failed (attempt {attempt + 1}): {e}", flush=True)
+
+                if attempt < self.max_retries:
+                    time.sleep(0.5 * 2 ** attempt)
+            except Exception as e:
+                print(f"Write-behind flush of {len(batch)} rows failed ({e}), writing them one by one", flush=True)
+                self._flush_rows(batch)
+                return
+            else:
+                with self.lock:
+                    self.stats['written'] += len(batch)
+                    self.stats['batches'] += 1
+
+                self._notify()
+                return
+
+        with self.lock:
+            self.stats['failed_rows'] += len(batch)
+
+    def _flush_rows(self, batch):
+        """Write each row in its own transaction, in queue order, dropping the ones that fail."""
+        written = 0
+
+        for kind, row in batch:
+            try:
+                self.writer([(kind, row)])
+            except Exception as e:
+                print(f"Dropped a {kind} row that could not be written: {e}", flush=True)
+            else:
+                written += 1
+
+        with self.lock:
+            self.stats['written'] += written
+            self.stats['failed_rows'] += len(batch) - written
+            self.stats['batches'] += 1
+
+        if written:
+            self._notify()
+
+    def _notify(self):
+        if self.on_written is not None:
+            self.on_written()
+
+    def _write_batch(self, batch):
+        conn = get_pool().getconn()
+
+        try:
+            with span("db.flush"), conn.cursor() as cur:
+                # consecutive rows of the same kind go out as one statement, in queue order
+                for kind, run in groupby(batch, key=lambda item: item[0]):
+                    write_rows(cur, kind, [row for _, row in run])
+
+                conn.commit()
+        finally:
+            get_pool().putconn(conn)
+
+
+FLUSH = object()
+STOP = object()
+
+write_behind_buffer = None
+write_behind_lock = threading.Lock()
+
+
+def get_write_behind_buffer():
+    """Return the process-wide write-behind buffer, or None when DB_WRITE_BEHIND is off."""
+    global write_behind_buffer
+
+    if not WRITE_BEHIND:
+        return None
+
+    with write_behind_lock:
+        if write_behind_buffer is None:
+            write_behind_buffer = WriteBehindBuffer()
+            atexit.register(write_behind_buffer.close)
+
+    return write_behind_buffer
+
+
+def flush_writes(timeout=None):
+    """Wait for buffered writes to reach the database; a no-op without write-behind."""
+    buffer = get_write_behind_buffer()
+
+    return buffer.flush(timeout) if buffer is not None else True
 
 
 def get_recent_conversations(limit=5, relevance=None):
-    conn = get_db_connection()
+    conn = get_pool().getconn()
 
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
@@ -129,31 +783,92 @@ def get_recent_conversations(limit=5, relevance=None):
                 FROM conversations c
                 LEFT JOIN feedback f ON c.id = f.conversation_id
             """
+            params = []
 
             if relevance:
-                query += f" WHERE c.relevance = '{relevance}'"
+                query += " WHERE c.relevance = %s"
+                params.append(relevance)
             
             query += " ORDER BY c.timestamp DESC LIMIT %s"
+            params.append(limit)
 
-            cur.execute(query, (limit,))
+            cur.execute(query, params)
 
             return cur.fetchall()
     finally:
-        conn.close()
+        get_pool().putconn(conn)
 
 
 def get_feedback_stats():
-    conn = get_db_connection()
+    conn = get_pool().getconn()
 
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("""
                 SELECT 
-                    SUM(CASE WHEN feedback > 0 THEN 1 ELSE 0 END) as thumbs_up,
-                    SUM(CASE WHEN feedback < 0 THEN 1 ELSE 0 END) as thumbs_down
-                FROM feedback
+                    COALESCE(SUM(thumbs_up), 0) as thumbs_up,
+                    COALESCE(SUM(thumbs_down), 0) as thumbs_down
+                FROM daily_stats
             """)
             
             return cur.fetchone()
     finally:
-        conn.close()
\ No newline at end of file
+        get_pool().putconn(conn)
+
+
+def get_relevance_distribution(limit=None):
+    """
+    Count conversations per relevance label.
+
+    With `limit`, only the most recent `limit` conversations are counted (served by the
+    timestamp index); otherwise the totals come from the daily rollup.
+    """
+    conn = get_pool().getconn()
+
+    try:
+        with conn.cursor() as cur:
+            if limit:
+                cur.execute("""
+                    SELECT relevance, COUNT(*)
+                    FROM (
+                        SELECT relevance FROM conversations ORDER BY timestamp DESC LIMIT %s
+                    ) recent
+                    GROUP BY relevance
+                """, (limit,))
+            else:
+                cur.execute("""
+                    SELECT relevance, SUM(conversations)
+                    FROM daily_stats
+                    GROUP BY relevance
+                """)
+
+            return {relevance: int(count) for relevance, count in cur.fetchall()}
+    finally:
+        get_pool().putconn(conn)
+
+
+def get_daily_stats(days=30):
+    """Per-day totals from the rollup for the last `days` days, oldest first."""
+    conn = get_pool().getconn()
+
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                SELECT
+                    day,
+                    SUM(conversations) AS conversations,
+                    SUM(thumbs_up) AS thumbs_up,
+                    SUM(thumbs_down) AS thumbs_down,
+                    SUM(prompt_tokens) AS prompt_tokens,
+                    SUM(completion_tokens) AS completion_tokens,
+                    SUM(eval_total_tokens) AS eval_total_tokens,
+                    SUM(claude_cost) AS claude_cost
+                FROM daily_stats
+                WHERE day > CURRENT_DATE - %s
+                GROUP BY day
+                ORDER BY day
+            """, (days,))
+
+            return cur.fetchall()
+    finally:
+        get_pool().putconn(conn)
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    Encodes concurrent queries together instead of one model call per query.
+
+    Callers block in encode() while a single dispatcher thread collects requests:
+    after the first one arrives it waits up to `max_wait` seconds or until `max_batch`
+    queries are queued, runs them through `encode_batch` as one batch, and hands each
+    caller its own row. Batch sizes and queueing delays are kept for get_stats().
+    """
+
+    def __init__(self, encode_batch, max_wait=0.005, max_batch=32, window=1000):
+        self.encode_batch = encode_batch
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'batches': 0, 'errors': 0}
+        self.batch_sizes = deque(maxlen=window)
+        self.queue_delays = deque(maxlen=window)
+        self.encode_times = deque(maxlen=window)
+
+        self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def encode(self, query):
+        future = Future()
+        self.requests.put((query, future, time.perf_counter()))
+
+        return future.result()
+
+    def get_stats(self):
+        with self.lock:
+            batch_sizes = np.array(self.batch_sizes) if self.batch_sizes else np.zeros(1)
+            queue_delays = np.array(self.queue_delays) * 1000 if self.queue_delays else np.zeros(1)
+            encode_times = np.array(self.encode_times) * 1000 if self.encode_times else np.zeros(1)
+
+            return {
+                **self.stats,
+                'batch_size_mean': float(batch_sizes.mean()),
+                'batch_size_max': int(batch_sizes.max()),
+                'queue_delay_ms_p50': float(np.percentile(queue_delays, 50)),
+                'queue_delay_ms_p99': float(np.percentile(queue_delays, 99)),
+                'encode_ms_p50': float(np.percentile(encode_times, 50)),
+                'encode_ms_p99': float(np.percentile(encode_times, 99)),
+            }
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+
+            # past the deadline, requests that are already queued still join the batch
+            try:
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start_time = time.perf_counter()
+
+            try:
+                vectors = self.encode_batch([query for query, _, _ in batch])
+            except Exception as e:
+                with self.lock:
+                    self.stats['errors'] += 1
+
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+                continue
+
+            encode_time = time.perf_counter() - start_time
+
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(np.asarray(vector, dtype=np.float32))
+
+            with self.lock:
+                self.stats['requests'] += len(batch)
+                self.stats['batches'] += 1
+                self.batch_sizes.append(len(batch))
+                self.encode_times.append(encode_time)
+                self.queue_delays.extend(start_time - submitted_at for _, _, submitted_at in batch)
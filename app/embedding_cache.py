@@ -0,0 +1,242 @@
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """Cache key for a query: case and whitespace differences map to the same vector."""
+    return " ".join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query vectors in front of an encode function.
+
+    With `path` set, vectors are also written to a memory-mapped float32 file
+    (`vectors.f32`) so the cache survives restarts. The key-to-row map is a snapshot in
+    `keys.json` plus an append-only `keys.log` of rows written since, folded into the
+    snapshot every `disk_size` writes and by flush(), which also runs at exit.
+    The disk tier holds `disk_size` vectors and reuses rows oldest-first.
+    `model` and `backend` are recorded in `keys.json`; a disk tier written by another
+    model or backend is discarded rather than served.
+    """
+
+    def __init__(self, encode, max_size=1024, path=None, disk_size=10000, dim=384, model=None, backend=None):
+        self.encode_fn = encode
+        self.model = model
+        self.backend = backend
+        self.max_size = max_size
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.vectors = OrderedDict()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+        self.path = path
+        self.disk = None
+
+        if path:
+            self._open_disk(path, disk_size)
+            atexit.register(self._flush_at_exit)
+
+    def encode(self, query):
+        key = normalize_query(query)
+
+        with self.lock:
+            vector = self.vectors.get(key)
+
+            if vector is not None:
+                self.vectors.move_to_end(key)
+                self.stats['hits'] += 1
+
+                return vector
+
+            vector = self._read_disk(key)
+
+            if vector is not None:
+                self.stats['disk_hits'] += 1
+                self._remember(key, vector)
+
+                return vector
+
+            self.stats['misses'] += 1
+
+        # encode outside the lock so concurrent misses don't serialize on the model
+        vector = np.asarray(self.encode_fn(query), dtype=np.float32)
+
+        with self.lock:
+            self._remember(key, vector)
+            slot = self._reserve_slot(key)
+
+        # the disk write happens outside the lock, so hits never wait for it
+        if slot is not None:
+            self._write_disk(key, slot, vector)
+
+        return vector
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'size': len(self.vectors)}
+
+    def clear(self):
+        with self.lock:
+            self.vectors.clear()
+
+    def flush(self):
+        """Write the memmap and a snapshot of the key map to disk, and empty the log."""
+        if self.disk is None:
+            return
+
+        with self.disk_lock:
+            self.disk.flush()
+
+            with self.lock:
+                snapshot = {**self.disk_index, 'slots': dict(self.disk_index['slots'])}
+
+            tmp_path = self.keys_path + ".tmp"
+
+            with open(tmp_path, "w") as f_out:
+                json.dump(snapshot, f_out)
+
+            os.replace(tmp_path, self.keys_path)
+
+            self.log.seek(0)
+            self.log.truncate()
+            self.log_entries = 0
+
+    def _flush_at_exit(self):
+        # e.g. a temporary directory that was already removed
+        if not os.path.isdir(self.path):
+            return
+
+        try:
+            self.flush()
+        except OSError as e:
+            # the log still holds every row written, so the next start replays it
+            print(f"Could not snapshot the embedding cache at {self.path}: {e}", flush=True)
+
+    def _remember(self, key, vector):
+        self.vectors[key] = vector
+        self.vectors.move_to_end(key)
+
+        while len(self.vectors) > self.max_size:
+            self.vectors.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _open_disk(self, path, disk_size):
+        os.makedirs(path, exist_ok=True)
+
+        vectors_path = os.path.join(path, "vectors.f32")
+        self.keys_path = os.path.join(path, "keys.json")
+        log_path = os.path.join(path, "keys.log")
+
+        index = {
+            'model': self.model, 'backend': self.backend, 'dim': self.dim, 'size': disk_size,
+            'next_slot': 0, 'slots': {},
+        }
+
+        if os.path.exists(self.keys_path) and os.path.exists(vectors_path):
+            with open(self.keys_path) as f_in:
+                stored = json.load(f_in)
+
+            # a store written for another model, backend or size can't be reused; same-sized vectors
+            # from a different encoder would be served silently, so everything must match
+            if all(stored.get(field) == index[field] for field in ('model', 'backend', 'dim', 'size')):
+                index = stored
+                self._replay_log(index, log_path)
+            else:
+                print(f"Discarding embedding cache at {path}: written by {stored.get('model')} "
+                      f"({stored.get('backend')}), now {self.model} ({self.backend})", flush=True)
+
+        mode = "r+" if index['slots'] else "w+"
+        self.disk = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(disk_size, self.dim))
+        self.disk_index = index
+        self.slot_keys = {slot: key for key, slot in index['slots'].items()}
+        # slot -> key for rows reserved by a miss but not written yet
+        self.pending = {}
+
+        # serializes the row writes and the log, which the lock doesn't cover
+        self.disk_lock = threading.Lock()
+        self.log = open(log_path, "a")
+        self.log_entries = 0
+        self.flush()
+
+    @staticmethod
+    def _replay_log(index, log_path):
+        """Apply the rows written since the snapshot to `index`, in order."""
+        if not os.path.exists(log_path):
+            return
+
+        slot_keys = {slot: key for key, slot in index['slots'].items()}
+
+        with open(log_path) as f_in:
+            for line in f_in:
+                try:
+                    key, slot = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash is the last one; its row may be incomplete too
+                    break
+
+                old_key = slot_keys.pop(slot, None)
+
+                if old_key is not None:
+                    index['slots'].pop(old_key, None)
+
+                index['slots'].pop(key, None)
+                index['slots'][key] = slot
+                slot_keys[slot] = key
+                index['next_slot'] = (slot + 1) % index['size']
+
+    def _read_disk(self, key):
+        if self.disk is None:
+            return None
+
+        slot = self.disk_index['slots'].get(key)
+
+        if slot is None:
+            return None
+
+        return np.array(self.disk[slot])
+
+    def _reserve_slot(self, key):
+        """Claim the next row for `key`, evicting its old key; None when there's nothing to write."""
+        if self.disk is None or key in self.disk_index['slots'] or key in self.pending.values():
+            return None
+
+        slot = self.disk_index['next_slot']
+        old_key = self.slot_keys.pop(slot, None)
+
+        if old_key is not None:
+            del self.disk_index['slots'][old_key]
+            self.stats['disk_evictions'] += 1
+
+        self.disk_index['next_slot'] = (slot + 1) % self.disk_index['size']
+        self.pending[slot] = key
+
+        return slot
+
+    def _write_disk(self, key, slot, vector):
+        with self.disk_lock:
+            with self.lock:
+                # the ring came round and a later miss owns the row now
+                if self.pending.get(slot) != key:
+                    return
+
+            self.disk[slot] = vector
+            # the row is written before the log names it, so a replayed log never points at a stale row
+            self.log.write(json.dumps([key, slot]) + "\n")
+            self.log.flush()
+            self.log_entries += 1
+
+            with self.lock:
+                del self.pending[slot]
+                self.disk_index['slots'][key] = slot
+                self.slot_keys[slot] = key
+
+            compact = self.log_entries >= self.disk_index['size']
+
+        if compact:
+            self.flush()
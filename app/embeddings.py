@@ -0,0 +1,191 @@
+import json
+import os
+
+import numpy as np
+
+
+MODEL_NAME = os.getenv("MODEL_NAME", "multi-qa-MiniLM-L6-cos-v1")
+
+# "torch" runs the SentenceTransformer as-is, "onnx" runs an exported ONNX Runtime session
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+
+# exported models are cached here, one directory per model name
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "/app/onnx_models")
+# int8 dynamic quantization of the weights; false runs the fp32 export
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "true").lower() == "true"
+# intra-op threads for the ONNX session; 0 lets ONNX Runtime use every core
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+ONNX_CONFIG_FILE = "encoder_config.json"
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+
+def export_onnx(model_name, output_dir):
+    """
+    Export a SentenceTransformer's transformer to ONNX, plus an int8-quantized copy.
+
+    Pooling and normalization are not part of the graph; their settings are written to
+    encoder_config.json and applied by OnnxEncoder, together with the saved tokenizer.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    print(f"Exporting {model_name} to ONNX in {output_dir}")
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    module_names = [type(module).__name__ for module in st_model]
+
+    if "Pooling" not in module_names:
+        raise ValueError(f"{model_name} has no Pooling module: {module_names}")
+
+    pooling = st_model[module_names.index("Pooling")].get_pooling_mode_str()
+
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode for ONNX export: {pooling}")
+
+    class TokenEmbeddings(torch.nn.Module):
+        # fixes the argument order and returns a plain tensor instead of a ModelOutput
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.auto_model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, return_dict=False
+            )[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    features = transformer.tokenizer(["warm up"], return_tensors="pt", return_token_type_ids=True)
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]}
+    fp32_path = os.path.join(output_dir, ONNX_FP32_FILE)
+
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer.auto_model.eval()),
+            tuple(features[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    quantize_dynamic(fp32_path, os.path.join(output_dir, ONNX_INT8_FILE), weight_type=QuantType.QInt8)
+    transformer.tokenizer.save_pretrained(output_dir)
+
+    # written last, so its presence means the export is complete
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w") as f_out:
+        json.dump({
+            'model_name': model_name,
+            'max_seq_length': st_model.max_seq_length,
+            'pooling': pooling,
+            'normalize': "Normalize" in module_names,
+        }, f_out, indent=4)
+
+
+class OnnxEncoder:
+    """
+    Runs an exported model through ONNX Runtime on CPU.
+
+    encode() takes the same arguments as SentenceTransformer.encode for the ways this repo
+    calls it: a string gives one vector, a list gives a float32 matrix in input order.
+    """
+
+    def __init__(self, model_dir, quantized=ONNX_QUANTIZE, threads=ONNX_THREADS):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE)) as f_in:
+            self.config = json.load(f_in)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.config['max_seq_length']
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        if threads > 0:
+            options.intra_op_num_threads = threads
+
+        model_path = os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_FP32_FILE)
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        single = isinstance(sentences, str)
+
+        if single:
+            sentences = [sentences]
+
+        # longest first, like SentenceTransformer, so each batch pads to similar lengths
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        starts = range(0, len(sentences), batch_size)
+
+        if show_progress_bar:
+            from tqdm.auto import tqdm
+
+            starts = tqdm(starts, desc="Batches")
+
+        for start in starts:
+            batch_indices = order[start:start + batch_size]
+            embeddings[batch_indices] = self._encode_batch([sentences[i] for i in batch_indices])
+
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, sentences):
+        features = self.tokenizer(
+            sentences, padding=True, truncation=True, max_length=self.max_seq_length,
+            return_tensors="np", return_token_type_ids=True,
+        )
+        inputs = {name: features[name].astype(np.int64) for name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        if self.config['pooling'] == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = inputs['attention_mask'][:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.config['normalize']:
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = pooled / np.clip(norms, 1e-12, None)
+
+        return pooled
+
+
+def onnx_model_dir(model_name):
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def backend_label(backend=EMBEDDING_BACKEND, quantized=ONNX_QUANTIZE):
+    """Name for the backend that tells apart encoders whose vectors differ, e.g. int8 and fp32 ONNX."""
+    if backend == "onnx":
+        return "onnx-int8" if quantized else "onnx-fp32"
+
+    return backend
+
+
+def load_encoder(model_name=MODEL_NAME, backend=EMBEDDING_BACKEND, quantized=ONNX_QUANTIZE, threads=ONNX_THREADS):
+    """Return an object with SentenceTransformer's encode(), exporting the ONNX model on first use."""
+    if backend == "onnx":
+        model_dir = onnx_model_dir(model_name)
+
+        if not os.path.exists(os.path.join(model_dir, ONNX_CONFIG_FILE)):
+            export_onnx(model_name, model_dir)
+
+        return OnnxEncoder(model_dir, quantized=quantized, threads=threads)
+
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    # sentence_transformers pulls in torch, so it is only imported for this backend
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
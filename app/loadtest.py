@@ -0,0 +1,372 @@
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import assistant
+import tracing
+from benchmark import GROUND_TRUTH_PATH
+
+
+class FakeElasticsearch:
+    """
+    Stands in for the Elasticsearch client, serving documents.json from a LocalIndex.
+
+    Answers the kNN and multi_match bodies built by assistant, plus msearch and mget,
+    after sleeping `latency` seconds per round trip to model the network hop.
+    """
+
+    def __init__(self, index, latency=0.0):
+        self.index = index
+        self.latency = latency
+        self.documents = {doc['id']: doc for doc in index.documents}
+
+    def options(self, **kwargs):
+        # per-request options such as request_timeout aren't modelled
+        return self
+
+    def search(self, index=None, body=None):
+        time.sleep(self.latency)
+
+        return self.run_search(body)
+
+    def msearch(self, searches):
+        # both searches share one round trip
+        time.sleep(self.latency)
+
+        return {'responses': [self.run_search(body) for body in searches[1::2]]}
+
+    def run_search(self, body):
+        start_time = time.perf_counter()
+
+        if 'knn' in body:
+            hits = self.index.knn_hits(body['knn']['query_vector'], size=body.get('size', 10))
+        else:
+            hits = self.index.keyword_hits(body['query']['multi_match']['query'], size=body.get('size', 10))
+
+        source_fields = body.get('_source')
+
+        if source_fields is not None:
+            hits = [
+                {**hit, '_source': {key: hit['_source'][key] for key in source_fields if key in hit['_source']}}
+                for hit in hits
+            ]
+
+        return {'took': int((time.perf_counter() - start_time) * 1000), 'hits': {'hits': hits}}
+
+    def mget(self, index=None, ids=(), source=None):
+        time.sleep(self.latency)
+        docs = []
+
+        for doc_id in ids:
+            doc = self.documents.get(doc_id)
+
+            if doc is None:
+                docs.append({'_id': doc_id, 'found': False})
+            else:
+                docs.append({'_id': doc_id, 'found': True,
+                             '_source': {key: doc[key] for key in (source or doc) if key in doc}})
+
+        return {'docs': docs}
+
+
+class FakeStream:
+    def __init__(self, message, first_token_delay, token_delay, chunks):
+        self.message = message
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        time.sleep(self.first_token_delay)
+
+        for i, chunk in enumerate(self.chunks):
+            if i:
+                time.sleep(self.token_delay)
+
+            yield chunk
+
+    def get_final_message(self):
+        return self.message
+
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **params):
+        message, first_token_delay, token_delay = self.client.respond(params)
+        time.sleep(first_token_delay + token_delay * message.usage.output_tokens)
+
+        return message
+
+    def stream(self, **params):
+        message, first_token_delay, token_delay = self.client.respond(params)
+        words = message.content[0].text.split(" ")
+
+        # roughly one chunk per output token, spread over the same generation time as create()
+        chunk_delay = token_delay * message.usage.output_tokens / max(len(words), 1)
+
+        return FakeStream(message, first_token_delay, chunk_delay, [word + " " for word in words])
+
+
+class FakeAnthropic:
+    """
+    Stands in for anthropic.Anthropic with a configurable response time and token counts.
+
+    A call takes `first_token_latency` plus `token_latency` per output token, each scaled by
+    up to +/- `jitter`. Relevance-evaluation prompts get a RELEVANT judgement in the
+    JSON shape parse_evaluation expects; everything else gets a filler answer.
+    """
+
+    def __init__(self, first_token_latency=0.4, token_latency=0.01, output_tokens=200, jitter=0.2, seed=None):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.messages = FakeMessages(self)
+
+    def respond(self, params):
+        prompt = params['messages'][0]['content']
+        system = "".join(block['text'] for block in params.get('system', []))
+        input_tokens = assistant.estimate_tokens(prompt + system)
+
+        if prompt.lstrip().startswith("You are an expert evaluator"):
+            text = json.dumps({'Relevance': "RELEVANT", 'Explanation': "Load test stand-in judgement."})
+            output_tokens = 30
+        else:
+            output_tokens = self.output_tokens
+            text = " ".join(["word"] * output_tokens)
+
+        with self.random_lock:
+            scale = 1 + self.random.uniform(-self.jitter, self.jitter)
+
+        message = SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=text)],
+            usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                                  cache_creation_input_tokens=0, cache_read_input_tokens=0),
+        )
+
+        return message, self.first_token_latency * scale, self.token_latency * scale
+
+
+def install_stand_ins(args):
+    """Point assistant at the fakes; the embedding model and search code still run for real."""
+    index = assistant.get_local_index()
+
+    assistant.RETRIEVAL_BACKEND = "elasticsearch"
+    assistant.RETRIEVAL_MODE = args.mode
+    assistant.set_singleton('es_client', FakeElasticsearch(index, latency=args.es_latency_ms / 1000))
+    assistant.set_singleton('claude_client', FakeAnthropic(
+        first_token_latency=args.llm_first_token_ms / 1000, token_latency=args.llm_token_ms / 1000,
+        output_tokens=args.output_tokens, jitter=args.jitter, seed=args.seed,
+    ))
+
+    # repeated ground-truth questions would otherwise be served from the caches
+    if not args.answer_cache:
+        assistant.set_singleton('answer_cache', None)
+    if not args.embedding_cache:
+        assistant.set_singleton('query_embedding_cache', None)
+
+    assistant.warm_up()
+
+
+def ask(question, args):
+    if args.stream:
+        chunks, answer_data = assistant.get_answer_stream(question, args.model_choice, args.defer_evaluation)
+
+        for _ in chunks:
+            pass
+
+        return answer_data
+
+    return assistant.get_answer(question, args.model_choice, args.defer_evaluation)
+
+
+def run_closed_loop(questions, args, concurrency, duration):
+    """`concurrency` users each ask their next question as soon as the last one is answered."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user(offset):
+        i = offset
+
+        while time.perf_counter() < deadline:
+            start_time = time.perf_counter()
+
+            try:
+                ask(questions[i % len(questions)], args)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            else:
+                with lock:
+                    latencies.append(time.perf_counter() - start_time)
+
+            i += concurrency
+
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(user, range(concurrency)))
+
+    return latencies, errors, time.perf_counter() - start_time
+
+
+def run_open_loop(questions, args, rate, duration):
+    """
+    Questions arrive as a Poisson process at `rate` per second regardless of how fast they're answered.
+
+    Latency is measured from the scheduled arrival, so time spent waiting for a free worker counts.
+    """
+    arrivals_random = random.Random(args.seed)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def handle(question, arrival_time):
+        try:
+            ask(question, args)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+        else:
+            with lock:
+                latencies.append(time.perf_counter() - arrival_time)
+
+    start_time = time.perf_counter()
+    next_arrival = start_time
+    i = 0
+
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as executor:
+        while next_arrival < start_time + duration:
+            time.sleep(max(0.0, next_arrival - time.perf_counter()))
+            executor.submit(handle, questions[i % len(questions)], next_arrival)
+            i += 1
+            next_arrival += arrivals_random.expovariate(rate)
+
+    return latencies, errors, time.perf_counter() - start_time
+
+
+def summarize(load, latencies, errors, elapsed):
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+
+    return {
+        'load': load,
+        'completed': len(latencies),
+        'errors': len(errors),
+        'throughput_qps': len(latencies) / elapsed,
+        'latency_ms_mean': float(latencies_ms.mean()),
+        'latency_ms_p50': float(np.percentile(latencies_ms, 50)),
+        'latency_ms_p95': float(np.percentile(latencies_ms, 95)),
+        'latency_ms_p99': float(np.percentile(latencies_ms, 99)),
+        'stage_ms_p99': {
+            stage: values[0.99] * 1000 for stage, values in tracing.metrics.percentiles().items()
+        },
+        'first_error': errors[0] if errors else None,
+    }
+
+
+def find_saturation(steps, slo_ms, min_gain=0.05):
+    """
+    First step where adding load stops paying off: throughput grows by less than `min_gain`
+    over the previous step, or p99 latency breaks the SLO. Returns None if no step saturates.
+    """
+    for previous, step in zip([None] + steps, steps):
+        if slo_ms and step['latency_ms_p99'] > slo_ms:
+            return {**step, 'reason': f"p99 {step['latency_ms_p99']:.0f} ms over the {slo_ms:.0f} ms SLO"}
+
+        if previous and step['throughput_qps'] < previous['throughput_qps'] * (1 + min_gain):
+            return {**step, 'reason': f"throughput grew less than {min_gain:.0%} over load {previous['load']}"}
+
+    return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test get_answer offline against Elasticsearch and Claude stand-ins")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH, help="CSV with a 'question' column")
+    parser.add_argument("--loop", choices=["closed", "open"], default="closed",
+                        help="closed: fixed number of concurrent users; open: fixed arrival rate")
+    parser.add_argument("--levels", default="1,2,4,8,16,32",
+                        help="comma-separated concurrency (closed) or questions/sec (open) to sweep")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="worker threads for the open loop")
+    parser.add_argument("--slo-ms", type=float, default=None, help="p99 latency that counts as saturated")
+    parser.add_argument("--model-choice", default="claude/3-haiku")
+    parser.add_argument("--stream", action="store_true", help="drive get_answer_stream instead of get_answer")
+    parser.add_argument("--defer-evaluation", action="store_true", help="skip the inline relevance judgement")
+    parser.add_argument("--mode", choices=["sequential", "msearch", "concurrent"], default=assistant.RETRIEVAL_MODE)
+    parser.add_argument("--es-latency-ms", type=float, default=2.0, help="round-trip time added per search call")
+    parser.add_argument("--llm-first-token-ms", type=float, default=400.0)
+    parser.add_argument("--llm-token-ms", type=float, default=10.0, help="time per output token")
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative spread of the stand-in latencies")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache on")
+    parser.add_argument("--embedding-cache", action="store_true", help="keep the query embedding cache on")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="write the results as JSON here")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    questions = pd.read_csv(args.ground_truth)["question"].tolist()
+    random.Random(args.seed).shuffle(questions)
+
+    install_stand_ins(args)
+
+    run = run_closed_loop if args.loop == "closed" else run_open_loop
+    levels = [float(level) if args.loop == "open" else int(level) for level in args.levels.split(",")]
+    steps = []
+
+    print(f"{'load':>8} {'done':>6} {'errors':>6} {'q/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+
+    for load in levels:
+        tracing.metrics = tracing.StageMetrics()
+
+        step = summarize(load, *run(questions, args, load, args.duration))
+        steps.append(step)
+
+        print(f"{load:>8} {step['completed']:>6} {step['errors']:>6} {step['throughput_qps']:>8.2f} "
+              f"{step['latency_ms_p50']:>9.1f} {step['latency_ms_p95']:>9.1f} {step['latency_ms_p99']:>9.1f}")
+
+        if step['first_error']:
+            print(f"         first error: {step['first_error']}")
+
+    saturation = find_saturation(steps, args.slo_ms)
+
+    if saturation is None:
+        print("No saturation within the levels tested")
+    else:
+        print(f"Saturated at load {saturation['load']}: {saturation['reason']}")
+        print("p99 per stage at saturation: " + ", ".join(
+            f"{stage} {ms:.1f} ms" for stage, ms in sorted(saturation['stage_ms_p99'].items())
+        ))
+
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump({'timestamp': time.time(), 'config': vars(args), 'steps': steps, 'saturation': saturation},
+                      f_out, indent=4)
+
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
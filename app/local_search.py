@@ -0,0 +1,192 @@
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+
+# same fields and boosts as the multi_match in assistant.build_keyword_query
+KEYWORD_FIELDS = {
+    "page_content": 2.0,
+    "header_1": 1.0,
+    "header_2": 1.0,
+    "header_3": 1.0,
+    "header_4": 1.0,
+    "header_5": 1.0,
+}
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercased word tokens, close to Elasticsearch's standard analyzer."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Field:
+    """Inverted index over one text field, scored like Elasticsearch's default BM25 similarity."""
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(texts)
+
+        postings = defaultdict(lambda: ([], []))
+        doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+
+        for doc_index, text in enumerate(texts):
+            if not text:
+                continue
+
+            tokens = tokenize(text)
+            doc_lengths[doc_index] = len(tokens)
+
+            for term, tf in Counter(tokens).items():
+                doc_indices, tfs = postings[term]
+                doc_indices.append(doc_index)
+                tfs.append(tf)
+
+        # documents without the field don't count towards its statistics, as in Elasticsearch
+        docs_with_field = int(np.count_nonzero(doc_lengths))
+        avg_length = doc_lengths.sum() / docs_with_field if docs_with_field else 1.0
+        self.length_norm = k1 * (1 - b + b * doc_lengths / avg_length)
+
+        self.postings = {}
+
+        for term, (doc_indices, tfs) in postings.items():
+            idf = math.log(1 + (docs_with_field - len(doc_indices) + 0.5) / (len(doc_indices) + 0.5))
+            self.postings[term] = (np.array(doc_indices), np.array(tfs, dtype=np.float32), idf)
+
+    def score(self, tokens):
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+
+        for term in tokens:
+            posting = self.postings.get(term)
+
+            if posting is None:
+                continue
+
+            doc_indices, tfs, idf = posting
+            scores[doc_indices] += idf * tfs * (self.k1 + 1) / (tfs + self.length_norm[doc_indices])
+
+        return scores
+
+
+class LocalIndex:
+    """
+    In-process replacement for the Elasticsearch index.
+
+    Holds the page_content vectors as one contiguous, L2-normalized float32 matrix
+    (optionally memory-mapped) for cosine top-k, and a BM25 index per keyword field.
+    Both searches return Elasticsearch-shaped hits so they fuse with the same RRF code.
+    """
+
+    def __init__(self, documents, vectors):
+        if len(documents) != len(vectors):
+            raise ValueError(f"{len(documents)} documents but {len(vectors)} vectors")
+
+        self.documents = documents
+        self.ids = [doc["id"] for doc in documents]
+        self.vectors = vectors
+        self.fields = {
+            field: (BM25Field([doc.get(field) for doc in documents]), boost)
+            for field, boost in KEYWORD_FIELDS.items()
+        }
+
+    @classmethod
+    def from_files(cls, documents_path, encode, vectors_path=None, batch_size=64, model=None, backend=None):
+        """
+        Load documents.json and their vectors.
+
+        Vectors are read from `vectors_path` (a .npy file, memory-mapped) when its sidecar
+        (`vectors_path` + ".json") records the same documents, `model` and `backend`;
+        otherwise they are encoded with `encode` and saved there, with the sidecar, for next time.
+        """
+        with open(documents_path, "rb") as f_in:
+            raw_documents = f_in.read()
+
+        documents = json.loads(raw_documents)
+        # rows line up with documents by position, so any edit (or reordering) invalidates the vectors
+        vectors_info = {
+            'model': model, 'backend': backend,
+            'documents_sha256': hashlib.sha256(raw_documents).hexdigest(),
+        }
+
+        vectors = None
+
+        if vectors_path and os.path.exists(vectors_path):
+            vectors = load_vectors(vectors_path, vectors_info, len(documents))
+
+        if vectors is None:
+            contents = [doc["page_content"] for doc in documents]
+            vectors = normalize_rows(np.asarray(encode(contents, batch_size=batch_size), dtype=np.float32))
+
+            if vectors_path:
+                np.save(vectors_path, vectors)
+
+                with open(vectors_path + ".json", "w") as f_out:
+                    json.dump(vectors_info, f_out)
+
+        return cls(documents, vectors)
+
+    def knn_hits(self, vector, size=10):
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        return self._top_hits(self.vectors @ query, size)
+
+    def keyword_hits(self, query, size=10):
+        tokens = tokenize(query)
+
+        # best_fields: a document scores with its best matching field
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+
+        for field_index, boost in self.fields.values():
+            np.maximum(scores, field_index.score(tokens) * boost, out=scores)
+
+        return self._top_hits(scores, size, min_score=0.0)
+
+    def _top_hits(self, scores, size, min_score=None):
+        size = min(size, len(scores))
+
+        if size == 0:
+            return []
+
+        top = np.argpartition(-scores, size - 1)[:size]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [
+            {"_id": self.ids[i], "_score": float(scores[i]), "_source": self.documents[i]}
+            for i in top
+            if min_score is None or scores[i] > min_score
+        ]
+
+
+def load_vectors(vectors_path, vectors_info, count):
+    """The saved vectors if their sidecar matches `vectors_info` and they cover `count` documents, else None."""
+    info_path = vectors_path + ".json"
+
+    if not os.path.exists(info_path):
+        return None
+
+    with open(info_path) as f_in:
+        if json.load(f_in) != vectors_info:
+            print(f"Re-encoding {vectors_path}: written for other documents or another encoder", flush=True)
+            return None
+
+    vectors = np.load(vectors_path, mmap_mode="r")
+
+    if vectors.shape[0] != count:
+        return None
+
+    return vectors
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return matrix / norms
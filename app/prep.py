@@ -1,11 +1,19 @@
 import os
+import json
+import time
+import hashlib
+import argparse
+import itertools
 import requests
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
+from contextlib import contextmanager
 from tqdm.auto import tqdm
 from dotenv import load_dotenv
-from db import init_db
+from db import init_db, migrate_db
+from answer_cache import write_index_version
+from embeddings import EMBEDDING_BACKEND, load_encoder
+from chunker import chunk_paths
 
 load_dotenv()
 
@@ -15,6 +23,19 @@ ELASTIC_URL = os.getenv("ELASTIC_URL")
 MODEL_NAME = os.getenv("MODEL_NAME")
 INDEX_NAME = os.getenv("INDEX_NAME")
 
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+ENCODE_PROCESSES = int(os.getenv("ENCODE_PROCESSES", "0"))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_THREADS = int(os.getenv("BULK_THREADS", "4"))
+# chunks hashed, encoded and indexed together; bounds memory however many documents there are
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "1000"))
+
+# "incremental" upserts changed chunks in place, "full" rebuilds into a new index behind the alias
+INDEX_MODE = os.getenv("INDEX_MODE", "incremental")
+
+# markdown files or directories to chunk locally instead of downloading the prebuilt documents.json
+DOCUMENTS_PATH = os.getenv("DOCUMENTS_PATH")
+
 BASE_URL = "https://github.com/agutiernc/contributor_assistant/blob/main"
 
 
@@ -31,6 +52,14 @@ def fetch_documents():
     return documents
 
 
+def chunk_documents(paths):
+    print(f"Chunking markdown from {', '.join(paths)}...")
+
+    # chunk ids are content-derived, so unchanged sections keep their id and are skipped by incremental updates;
+    # chunks are produced lazily and consumed batch by batch by index_documents
+    return chunk_paths(paths)
+
+
 def fetch_ground_truth():
     print("Fetching ground truth data...")
 
@@ -46,80 +75,300 @@ def fetch_ground_truth():
 
 
 def load_model():
-    print(f"Loading model: {MODEL_NAME}")
-
-    return SentenceTransformer(MODEL_NAME)
+    print(f"Loading model: {MODEL_NAME} ({EMBEDDING_BACKEND} backend)")
+
+    return load_encoder(MODEL_NAME)
+
+
+INDEX_SETTINGS = {
+  "settings": {
+    "number_of_shards": 1,
+    "number_of_replicas": 0
+  },
+  "mappings": {
+    "dynamic": True,
+    "properties": {
+      "id": { "type": "keyword" },
+      "content_hash": { "type": "keyword" },
+      "source": { "type": "keyword" },
+      "page_content": { "type": "text" },
+      "header_1": { "type": "text" },
+      "header_2": { "type": "text" },
+      "header_3": { "type": "text" },
+      "header_4": { "type": "text"},
+      "header_5": { "type": "text"},
+      "page_content_vector": {
+        "type": "dense_vector",
+        "dims": 384,
+        "index": True,
+        "similarity": "cosine"
+      }
+    }
+  }
+}
 
 
 def setup_elasticsearch():
     print("Setting up Elasticsearch...")
 
-    es_client = Elasticsearch(ELASTIC_URL)
-
-    index_settings = {
-      "settings": {
-        "number_of_shards": 1,
-        "number_of_replicas": 0
-      },
-      "mappings": {
-        "dynamic": True,
-        "properties": {
-          "id": { "type": "keyword" },
-          "page_content": { "type": "text" },
-          "header_1": { "type": "text" },
-          "header_2": { "type": "text" },
-          "header_3": { "type": "text" },
-          "header_4": { "type": "text"},
-          "header_5": { "type": "text"},
-          "page_content_vector": {
-            "type": "dense_vector",
-            "dims": 384,
-            "index": True,
-            "similarity": "cosine"
-          }
-        }
-      }
-    }
+    return Elasticsearch(ELASTIC_URL)
+
+
+def content_hash(doc):
+    """Hash of everything that ends up in the index for a chunk, except its vector."""
+    fields = {key: value for key, value in doc.items() if key not in ("page_content_vector", "content_hash")}
+
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def alias_exists(es_client):
+    return bool(es_client.indices.exists_alias(name=INDEX_NAME))
+
+
+def create_versioned_index(es_client):
+    index_name = f"{INDEX_NAME}_{time.strftime('%Y%m%d%H%M%S')}"
+    es_client.indices.create(index=index_name, body=INDEX_SETTINGS)
+
+    print(f"Elasticsearch index '{index_name}' created")
+
+    return index_name
+
+
+def swap_alias(es_client, new_index):
+    """Atomically point INDEX_NAME at new_index, then delete the indices it replaced."""
+    actions = [{"add": {"index": new_index, "alias": INDEX_NAME}}]
+    old_indices = []
+
+    if alias_exists(es_client):
+        old_indices = list(es_client.indices.get_alias(name=INDEX_NAME).keys())
+        actions = [{"remove": {"index": index, "alias": INDEX_NAME}} for index in old_indices] + actions
+    elif es_client.indices.exists(index=INDEX_NAME):
+        # an index created before aliases were used has the alias' name, so it goes in the same swap
+        actions.append({"remove_index": {"index": INDEX_NAME}})
+
+    es_client.indices.update_aliases(actions=actions)
+
+    print(f"Alias '{INDEX_NAME}' now points to '{new_index}'")
+
+    for index in old_indices:
+        if index != new_index:
+            es_client.indices.delete(index=index, ignore_unavailable=True)
+
+            print(f"Deleted old index '{index}'")
+
+
+def batches(documents, size):
+    """Yield lists of up to `size` documents from any iterable, without reading ahead."""
+    documents = iter(documents)
+
+    while batch := list(itertools.islice(documents, size)):
+        yield batch
+
+
+def full_rebuild(es_client, documents, model):
+    """Load every document into a new versioned index and switch the alias to it."""
+    print("Running full rebuild...")
+
+    new_index = create_versioned_index(es_client)
+    total = 0
+
+    try:
+        with refresh_paused(es_client, new_index), document_encoder(model) as encode:
+            for batch in batches(documents, INDEX_BATCH_SIZE):
+                for doc in batch:
+                    doc['content_hash'] = content_hash(doc)
+
+                encode(batch)
+                bulk_index(es_client, batch, new_index)
+                total += len(batch)
+    except Exception:
+        es_client.indices.delete(index=new_index, ignore_unavailable=True)
+        raise
+
+    print(f"Indexed {total} documents")
+
+    swap_alias(es_client, new_index)
+
+
+def get_indexed_hashes(es_client):
+    hits = helpers.scan(es_client, index=INDEX_NAME, query={"query": {"match_all": {}}}, _source=["content_hash"])
+
+    return {hit["_id"]: hit["_source"].get("content_hash") for hit in hits}
+
 
-    es_client.indices.delete(index=INDEX_NAME, ignore_unavailable=True)
-    es_client.indices.create(index=INDEX_NAME, body=index_settings)
+def incremental_update(es_client, documents, model):
+    """Re-embed and upsert only new or changed chunks, and delete chunks that were removed."""
+    print("Running incremental update...")
 
-    print(f"Elasticsearch index '{INDEX_NAME}' created")
+    indexed_hashes = get_indexed_hashes(es_client)
+    current_ids = set()
+    changed_count = 0
 
-    return es_client
+    with refresh_paused(es_client, INDEX_NAME), document_encoder(model) as encode:
+        for batch in batches(documents, INDEX_BATCH_SIZE):
+            changed = []
 
+            for doc in batch:
+                doc['content_hash'] = content_hash(doc)
+                current_ids.add(doc['id'])
 
-def index_documents(es_client, documents, model):
+                if indexed_hashes.get(doc['id']) != doc['content_hash']:
+                    changed.append(doc)
+
+            if changed:
+                encode(changed)
+                bulk_index(es_client, changed, INDEX_NAME)
+                changed_count += len(changed)
+
+        removed_ids = [doc_id for doc_id in indexed_hashes if doc_id not in current_ids]
+
+        if removed_ids:
+            bulk_index(es_client, [], INDEX_NAME, removed_ids)
+
+    print(f"{changed_count} new or changed, {len(removed_ids)} removed, "
+          f"{len(current_ids) - changed_count} unchanged")
+
+    return bool(changed_count or removed_ids)
+
+
+@contextmanager
+def document_encoder(model):
+    """Yield a function that encodes a batch of documents, sharing one process pool across batches."""
+    pool = None
+
+    # the ONNX backend parallelizes inside its session (ONNX_THREADS) instead of across processes
+    if ENCODE_PROCESSES > 1 and hasattr(model, 'start_multi_process_pool'):
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * ENCODE_PROCESSES)
+
+    try:
+        yield lambda documents: encode_documents(documents, model, pool)
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+
+def encode_documents(documents, model, pool=None):
+    print("Encoding documents...")
+
+    contents = [doc.get('page_content') for doc in documents]
+    start_time = time.time()
+
+    if pool is not None:
+        vectors = model.encode_multi_process(contents, pool, batch_size=ENCODE_BATCH_SIZE)
+    else:
+        vectors = model.encode(contents, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True)
+
+    elapsed = time.time() - start_time
+
+    for doc, vector in zip(documents, vectors):
+        doc['page_content_vector'] = vector
+
+    print(f"Encoded {len(documents)} documents in {elapsed:.2f} seconds "
+          f"({len(documents) / max(elapsed, 1e-9):.1f} docs/sec)")
+
+
+def bulk_actions(documents, index_name, deleted_ids=()):
+    for doc in documents:
+        yield {"_index": index_name, "_id": doc["id"], "_source": doc}
+
+    for doc_id in deleted_ids:
+        yield {"_op_type": "delete", "_index": index_name, "_id": doc_id}
+
+
+@contextmanager
+def refresh_paused(es_client, index_name):
+    """Disable refresh on index_name for the whole load, then restore it and refresh once."""
+    es_client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1"}})
+
+    try:
+        yield
+    finally:
+        es_client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": None}})
+        es_client.indices.refresh(index=index_name)
+
+
+def bulk_index(es_client, documents, index_name, deleted_ids=()):
+    """Send one batch of documents (and deletions) through the bulk helpers."""
     print("Indexing documents...")
 
-    for doc in tqdm(documents):
-      # extract content from doc
-      content = doc.get('page_content')
- 
-      # encode content
-      doc['page_content_vector'] = model.encode(content)
+    start_time = time.time()
+    failed = 0
+
+    actions = bulk_actions(documents, index_name, deleted_ids)
+
+    if BULK_THREADS > 1:
+        results = helpers.parallel_bulk(
+            es_client, actions, thread_count=BULK_THREADS, chunk_size=BULK_CHUNK_SIZE, raise_on_error=False
+        )
+    else:
+        results = helpers.streaming_bulk(
+            es_client, actions, chunk_size=BULK_CHUNK_SIZE, raise_on_error=False
+        )
+
+    for ok, item in tqdm(results, total=len(documents) + len(deleted_ids)):
+        if not ok:
+            failed += 1
+            print(f"Failed to index document: {item}")
+
+    elapsed = time.time() - start_time
+
+    total = len(documents) + len(deleted_ids)
+
+    print(f"Indexed {len(documents)} and deleted {len(deleted_ids)} documents in {elapsed:.2f} seconds "
+          f"({total / max(elapsed, 1e-9):.1f} docs/sec), {failed} failed")
 
-      es_client.index(index=INDEX_NAME, document=doc)
-      
-    print(f"Indexed {len(documents)} documents")
+
+def index_documents(es_client, documents, model, full=False):
+    """
+    Bring the index behind INDEX_NAME up to date; returns True when anything changed.
+
+    `documents` may be any iterable, e.g. the chunk generator; it is read INDEX_BATCH_SIZE at a time.
+    """
+    if full or not alias_exists(es_client):
+        full_rebuild(es_client, documents, model)
+
+        return True
+
+    return incremental_update(es_client, documents, model)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index the contributing guidelines into Elasticsearch")
+    parser.add_argument("--full", action="store_true", default=INDEX_MODE == "full",
+                        help="rebuild into a new index and swap the alias instead of updating in place")
+    parser.add_argument("--documents", nargs="+", default=[DOCUMENTS_PATH] if DOCUMENTS_PATH else None,
+                        help="markdown files or directories to chunk instead of fetching documents.json")
+
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+
     print("Starting the indexing process...")
 
-    documents = fetch_documents()
+    documents = chunk_documents(args.documents) if args.documents else fetch_documents()
     ground_truth = fetch_ground_truth()
     model = load_model()
     es_client = setup_elasticsearch()
+
+    # the first run also creates the database; later runs only refresh the index and migrate the schema
+    first_run = not es_client.indices.exists(index=INDEX_NAME)
     
-    index_documents(es_client, documents, model)
+    if index_documents(es_client, documents, model, full=args.full):
+        write_index_version()
+
+    if first_run:
+        print("Initializing database...")
 
-    print("Initializing database...")
+        init_db()
+    else:
+        print("Migrating database...")
 
-    init_db()
+        migrate_db()
 
     print("Indexing process completed successfully!")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
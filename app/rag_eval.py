@@ -0,0 +1,251 @@
+import argparse
+import csv
+import io
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import anthropic
+import pandas as pd
+
+import assistant
+from benchmark import GROUND_TRUTH_PATH
+from resilience import CircuitOpenError, DeadlineExceeded
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+# the first five match the CSVs the notebook produced
+FIELDS = [
+    "answer", "id", "question", "relevance", "explanation",
+    "model_used", "prompt_tokens", "completion_tokens", "eval_prompt_tokens", "eval_completion_tokens",
+    "claude_cost", "eval_cost", "response_time",
+]
+
+# worth retrying: rate limits, overload (529), unavailability (503) and other 5xx, dropped connections
+# and timeouts, plus requests that ran out of deadline or were turned away by an open circuit breaker
+RETRYABLE_ERRORS = (
+    anthropic.RateLimitError, anthropic.OverloadedError, anthropic.ServiceUnavailableError,
+    anthropic.InternalServerError, anthropic.APIConnectionError,
+    CircuitOpenError, DeadlineExceeded,
+)
+
+
+class Backoff:
+    """
+    Retries calls on retryable API errors with exponential backoff and jitter.
+
+    A rate limit pauses every worker, not just the one that hit it, until the server's
+    retry-after (or the backoff delay) has passed, so the pool doesn't keep hammering the API.
+    """
+
+    def __init__(self, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pause_until = 0.0
+        self.retries = 0
+
+    def call(self, function, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._wait()
+
+            try:
+                return function(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+
+                delay = retry_after(e) or min(self.base_delay * 2 ** attempt, self.max_delay) * random.uniform(0.5, 1.5)
+                print(f"{type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1})", flush=True)
+
+                with self.lock:
+                    self.retries += 1
+
+                    if isinstance(e, anthropic.RateLimitError):
+                        self.pause_until = max(self.pause_until, time.time() + delay)
+
+                time.sleep(delay)
+
+    def _wait(self):
+        with self.lock:
+            pause = self.pause_until - time.time()
+
+        if pause > 0:
+            time.sleep(pause)
+
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def default_output(model_choice):
+    # not the notebook's rag-eval-<model>.csv, which has only the first five FIELDS
+    return os.path.join(DATA_DIR, f"rag-eval-{model_choice.replace('/', '-')}-runs.csv")
+
+
+def load_checkpoint(path):
+    """
+    Return the rows already written to `path`, keeping only complete ones.
+
+    A run killed mid-write can leave a truncated last row; the file is rewritten
+    without it so the resumed run appends after the last complete row. A file with
+    other columns, such as the notebook's CSVs, is never rewritten or appended to.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return []
+
+    with open(path, newline="") as f_in:
+        text = f_in.read()
+
+    reader = csv.DictReader(io.StringIO(text))
+
+    if reader.fieldnames != FIELDS:
+        raise SystemExit(
+            f"{path} has the columns {reader.fieldnames}, not the ones this runner writes; "
+            f"pass a new --output to start a fresh file"
+        )
+
+    rows = list(reader)
+    complete = [row for row in rows if all(row.get(field) is not None for field in FIELDS) and row["relevance"]]
+
+    # without a trailing newline the last row was cut off, even if every field still parses
+    if complete and rows and complete[-1] is rows[-1] and not text.endswith("\n"):
+        complete.pop()
+
+    if len(complete) != len(rows) or not text.endswith("\n"):
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "w", newline="") as f_out:
+            writer = csv.DictWriter(f_out, fieldnames=FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(complete)
+
+        os.replace(tmp_path, path)
+        print(f"Dropped {len(rows) - len(complete)} incomplete rows from {path}")
+
+    return complete
+
+
+def evaluate_record(record, model_choice, backoff):
+    """Answer one ground-truth question and judge the answer, retrying each call separately."""
+    question = record["question"]
+
+    # a Sonnet run must only hold Sonnet answers, so an unavailable model is retried, not swapped for Haiku
+    answer_data = backoff.call(assistant.get_answer, question, model_choice, True, model_fallback=False)
+    relevance, explanation, eval_tokens = backoff.call(assistant.evaluate_relevance, question, answer_data["answer"])
+
+    return {
+        "answer": answer_data["answer"],
+        "id": record["id"],
+        "question": question,
+        "relevance": relevance,
+        "explanation": explanation,
+        "model_used": answer_data["model_used"],
+        "prompt_tokens": answer_data["prompt_tokens"],
+        "completion_tokens": answer_data["completion_tokens"],
+        "eval_prompt_tokens": eval_tokens["prompt_tokens"],
+        "eval_completion_tokens": eval_tokens["completion_tokens"],
+        "claude_cost": answer_data["claude_cost"],
+        "eval_cost": assistant.calculate_claude_cost("claude/3-haiku", eval_tokens),
+        "response_time": answer_data["response_time"],
+    }
+
+
+def summarize(rows, new_rows, failures, elapsed, retries):
+    relevance = Counter(row["relevance"] for row in rows)
+
+    print(f"\n{len(rows)} rows in total ({new_rows} new this run, {failures} failed, {retries} retries)")
+
+    for label, count in relevance.most_common():
+        print(f"  {label:<16} {count:>5}  {count / len(rows):.1%}")
+
+    def total(field, cast=float):
+        return sum(cast(row[field] or 0) for row in rows)
+
+    print(f"Answer tokens: {total('prompt_tokens', int)} prompt, {total('completion_tokens', int)} completion")
+    print(f"Eval tokens:   {total('eval_prompt_tokens', int)} prompt, {total('eval_completion_tokens', int)} completion")
+    print(f"Cost: ${total('claude_cost'):.4f} answers + ${total('eval_cost'):.4f} evaluation")
+
+    if new_rows:
+        print(f"This run: {new_rows} rows in {elapsed:.1f}s ({new_rows / elapsed:.2f} rows/sec)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Answer and judge the ground-truth questions, resuming where a run stopped")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH)
+    parser.add_argument("--model", default="claude/3-haiku", help="model choice, as in the app sidebar")
+    parser.add_argument("--output", default=None, help="CSV to append to; defaults to data/rag-eval-<model>-runs.csv")
+    parser.add_argument("--concurrency", type=int, default=4, help="questions in flight at once")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N questions")
+    parser.add_argument("--max-retries", type=int, default=6, help="retries per call on rate limits and overload")
+    parser.add_argument("--base-delay", type=float, default=1.0, help="first backoff delay in seconds")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = args.output or default_output(args.model)
+
+    ground_truth = pd.read_csv(args.ground_truth).to_dict(orient="records")
+
+    if args.limit is not None:
+        ground_truth = ground_truth[:args.limit]
+
+    rows = load_checkpoint(output)
+    done = {(row["id"], row["question"]) for row in rows}
+    pending = [record for record in ground_truth if (record["id"], record["question"]) not in done]
+
+    print(f"{len(done)} questions already evaluated in {output}, {len(pending)} to go with {args.model}")
+
+    # every question should reach the model; a near-duplicate's cached answer would skew the evaluation
+    assistant.set_singleton('answer_cache', None)
+
+    backoff = Backoff(max_retries=args.max_retries, base_delay=args.base_delay)
+    write_header = not os.path.exists(output) or os.path.getsize(output) == 0
+    new_rows, failures = 0, 0
+    start_time = time.time()
+
+    with open(output, "a", newline="") as f_out, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        writer = csv.DictWriter(f_out, fieldnames=FIELDS, extrasaction="ignore")
+
+        if write_header:
+            writer.writeheader()
+
+        futures = {executor.submit(evaluate_record, record, args.model, backoff): record for record in pending}
+
+        # rows are written as they finish, so an interrupted run keeps everything completed so far
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"Failed on '{futures[future]['question']}': {e}", flush=True)
+                continue
+
+            writer.writerow(row)
+            f_out.flush()
+            rows.append(row)
+            new_rows += 1
+
+            if new_rows % 10 == 0:
+                print(f"{len(rows)}/{len(done) + len(pending)} done", flush=True)
+
+    if rows:
+        summarize(rows, new_rows, failures, time.time() - start_time, backoff.retries)
+
+    if failures:
+        print(f"{failures} questions failed; run again to retry them")
+
+
+if __name__ == "__main__":
+    main()
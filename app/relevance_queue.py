@@ -0,0 +1,134 @@
+import os
+import queue
+import threading
+import time
+
+from assistant import evaluate_relevance, remember_answer
+from db import update_relevance
+
+
+RELEVANCE_WORKERS = int(os.getenv("RELEVANCE_WORKERS", "2"))
+RELEVANCE_QUEUE_SIZE = int(os.getenv("RELEVANCE_QUEUE_SIZE", "1000"))
+RELEVANCE_MAX_RETRIES = int(os.getenv("RELEVANCE_MAX_RETRIES", "3"))
+
+
+class RelevanceQueue:
+    """
+    Judges saved conversations in the background so answers can be returned right away.
+
+    Conversations are saved with relevance PENDING and submitted here; a fixed pool of
+    worker threads calls `evaluate` and writes the judgement back with `store`. Failed
+    judgements are retried with exponential backoff, and after the last attempt the
+    conversation is marked UNKNOWN so it doesn't stay PENDING forever. Successful
+    judgements are also passed to `on_judged`, e.g. to fill the semantic answer cache.
+    """
+
+    def __init__(self, evaluate=evaluate_relevance, store=update_relevance, on_judged=remember_answer,
+                 workers=RELEVANCE_WORKERS, max_size=RELEVANCE_QUEUE_SIZE, max_retries=RELEVANCE_MAX_RETRIES,
+                 retry_delay=1.0):
+        self.evaluate = evaluate
+        self.store = store
+        self.on_judged = on_judged
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.jobs = queue.Queue(maxsize=max_size)
+        self.lock = threading.Condition()
+        self.pending = 0
+        self.stats = {'submitted': 0, 'judged': 0, 'retries': 0, 'failed': 0}
+
+        self.workers = [
+            threading.Thread(target=self._work, name=f"relevance-judge-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, conversation_id, question, answer, model_choice=None, block=True, timeout=None):
+        """Queue a conversation for judging; blocks while the queue is full unless block=False."""
+        with self.lock:
+            self.pending += 1
+            self.stats['submitted'] += 1
+
+        try:
+            self.jobs.put((conversation_id, question, answer, model_choice), block=block, timeout=timeout)
+        except queue.Full:
+            with self.lock:
+                self.pending -= 1
+                self.stats['submitted'] -= 1
+                self.lock.notify_all()
+            raise
+
+    def drain(self, timeout=None):
+        """Wait until every submitted conversation has been judged. Returns False on timeout."""
+        with self.lock:
+            return self.lock.wait_for(lambda: self.pending == 0, timeout=timeout)
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'pending': self.pending}
+
+    def _work(self):
+        while True:
+            conversation_id, question, answer, model_choice = self.jobs.get()
+
+            try:
+                self._judge(conversation_id, question, answer, model_choice)
+            finally:
+                self.jobs.task_done()
+
+                with self.lock:
+                    self.pending -= 1
+                    self.lock.notify_all()
+
+    def _judge(self, conversation_id, question, answer, model_choice):
+        for attempt in range(self.max_retries + 1):
+            try:
+                relevance, explanation, eval_tokens = self.evaluate(question, answer)
+                self.store(conversation_id, relevance, explanation, eval_tokens)
+            except Exception as e:
+                error = e
+
+                if attempt < self.max_retries:
+                    with self.lock:
+                        self.stats['retries'] += 1
+
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                with self.lock:
+                    self.stats['judged'] += 1
+
+                if self.on_judged is not None and model_choice is not None:
+                    try:
+                        self.on_judged(question, answer, model_choice, relevance, explanation)
+                    except Exception as e:
+                        print(f"on_judged failed for {conversation_id}: {e}", flush=True)
+
+                return
+
+        print(f"Relevance evaluation failed for {conversation_id}: {error}", flush=True)
+
+        with self.lock:
+            self.stats['failed'] += 1
+
+        try:
+            self.store(conversation_id, "UNKNOWN", f"Evaluation failed: {error}",
+                       {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0})
+        except Exception as e:
+            print(f"Could not mark {conversation_id} as UNKNOWN: {e}", flush=True)
+
+
+relevance_queue = None
+relevance_queue_lock = threading.Lock()
+
+
+def get_relevance_queue():
+    """Return the process-wide queue, starting its workers on first use."""
+    global relevance_queue
+
+    with relevance_queue_lock:
+        if relevance_queue is None:
+            relevance_queue = RelevanceQueue()
+
+    return relevance_queue
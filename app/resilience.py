@@ -0,0 +1,354 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import numpy as np
+
+from tracing import metrics
+
+
+# seconds a whole answer may take, from retrieval to evaluation; 0 disables the deadline
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+# share of the deadline each stage gets; time a stage doesn't use is passed on to the later ones
+DEADLINE_SHARES = {
+    'search': float(os.getenv("DEADLINE_SHARE_SEARCH", "0.15")),
+    'llm': float(os.getenv("DEADLINE_SHARE_LLM", "0.6")),
+    'evaluation': float(os.getenv("DEADLINE_SHARE_EVALUATION", "0.25")),
+}
+
+# send a duplicate search leg once the first has taken longer than this percentile of recent legs
+SEARCH_HEDGING = os.getenv("SEARCH_HEDGING", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+
+# a dependency failing this many times in a row is skipped for BREAKER_RESET_TIMEOUT seconds
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# the Deadline of the request being handled in this context, or None outside one
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class Deadline:
+    """A time limit for one request, handed out to the pipeline stages as per-call timeouts."""
+
+    def __init__(self, seconds=REQUEST_DEADLINE, shares=None):
+        self.seconds = seconds
+        self.shares = shares or DEADLINE_SHARES
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def stage_timeout(self, stage):
+        """
+        Seconds `stage` may take: its share of what's left, relative to the stages after it.
+
+        The last stage gets everything that remains. Raises DeadlineExceeded once the
+        deadline has passed.
+        """
+        remaining = self.remaining()
+
+        if remaining <= 0:
+            metrics.increment("rag_deadline_exceeded_total", stage=stage)
+            raise DeadlineExceeded(f"No time left for {stage}")
+
+        stages = list(self.shares)
+        later_shares = sum(self.shares[name] for name in stages[stages.index(stage):])
+
+        return remaining * self.shares[stage] / later_shares
+
+
+@contextmanager
+def deadline(seconds=REQUEST_DEADLINE, existing=None):
+    """Run the block under a new deadline of `seconds`, or again under an `existing` one."""
+    if existing is None and seconds > 0:
+        existing = Deadline(seconds)
+
+    token = current_deadline.set(existing)
+
+    try:
+        yield existing
+    finally:
+        current_deadline.reset(token)
+
+
+def stage_timeout(stage):
+    """Timeout for a call made by `stage` under the current deadline, or None without one."""
+    request_deadline = current_deadline.get()
+
+    if request_deadline is None:
+        return None
+
+    return request_deadline.stage_timeout(stage)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is down.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls are
+    rejected with CircuitOpenError. Once `reset_timeout` seconds have passed one trial
+    call is let through: success closes the breaker, failure opens it again. Only
+    exceptions of `failure_types` count as failures; others (e.g. a bad request) pass through.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 failure_types=(Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_types = failure_types
+
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+
+        return "open"
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self.lock:
+            state = self._state()
+
+            if state == "closed":
+                return
+
+            if state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                return
+
+        metrics.increment("rag_breaker_rejections_total", breaker=self.name)
+        raise CircuitOpenError(f"{self.name} is unavailable")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            tripped = self.trial_running or (self.opened_at is None and self.failures >= self.failure_threshold)
+            self.trial_running = False
+
+            if tripped:
+                self.opened_at = time.monotonic()
+
+        if tripped:
+            metrics.increment("rag_breaker_trips_total", breaker=self.name)
+            print(f"Circuit breaker {self.name} opened after {self.failures} failures", flush=True)
+
+    def release(self):
+        """End a call that failed for reasons of its own (or was abandoned) without judging the dependency."""
+        with self.lock:
+            self.trial_running = False
+
+    def call(self, function, *args, **kwargs):
+        self.allow()
+
+        try:
+            result = function(*args, **kwargs)
+        except self.failure_types:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+
+        self.record_success()
+
+        return result
+
+    async def call_async(self, function, *args, **kwargs):
+        """Like call, awaiting the coroutine function `function`."""
+        self.allow()
+
+        try:
+            result = await function(*args, **kwargs)
+        except self.failure_types:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+
+        self.record_success()
+
+        return result
+
+
+class Hedger:
+    """
+    Sends a second copy of a slow call and takes whichever copy answers first.
+
+    A call is hedged once it has run longer than `percentile` of the recent latencies
+    of this leg, so about 1 - percentile of calls cost a duplicate request while the
+    tail is cut to roughly the latency of the faster copy.
+    """
+
+    def __init__(self, name, executor, percentile=HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES, window=500):
+        self.name = name
+        self.executor = executor
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+
+    def hedge_delay(self):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+
+            latencies = np.array(self.latencies)
+
+        return float(np.quantile(latencies, self.percentile))
+
+    def observe(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def call(self, function, timeout=None):
+        """Run `function`, hedged once there is enough history; gives up after `timeout` seconds."""
+        start_time = time.monotonic()
+        delay = self.hedge_delay()
+
+        if delay is None or (timeout is not None and delay >= timeout):
+            result = function()
+            self.observe(time.monotonic() - start_time)
+            return result
+
+        pending = {self.executor.submit(function)}
+        done, pending = wait(pending, timeout=delay)
+
+        if not done:
+            metrics.increment("rag_hedges_fired_total", leg=self.name)
+            pending.add(self.executor.submit(function))
+
+        error = None
+
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    self.observe(time.monotonic() - start_time)
+                    return future.result()
+
+                error = future.exception()
+
+            if not pending:
+                raise error
+
+            remaining = None if timeout is None else timeout - (time.monotonic() - start_time)
+
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded(f"{self.name} took longer than {timeout:.2f}s")
+
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+    async def call_async(self, function, timeout=None):
+        """Like call, for a coroutine function; the copy that loses is cancelled."""
+        start_time = time.monotonic()
+        delay = self.hedge_delay()
+
+        if delay is None or (timeout is not None and delay >= timeout):
+            try:
+                result = await asyncio.wait_for(function(), timeout)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"{self.name} took longer than {timeout:.2f}s") from None
+
+            self.observe(time.monotonic() - start_time)
+            return result
+
+        pending = {asyncio.ensure_future(function())}
+
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+
+            if not done:
+                metrics.increment("rag_hedges_fired_total", leg=self.name)
+                pending.add(asyncio.ensure_future(function()))
+
+            error = None
+
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        self.observe(time.monotonic() - start_time)
+                        return task.result()
+
+                    error = task.exception()
+
+                if not pending:
+                    raise error
+
+                remaining = None if timeout is None else timeout - (time.monotonic() - start_time)
+
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceeded(f"{self.name} took longer than {timeout:.2f}s")
+
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+breakers = {}
+hedgers = {}
+registry_lock = threading.Lock()
+hedge_executor = None
+
+
+def get_breaker(name, **kwargs):
+    """The process-wide breaker for dependency `name`, created with `kwargs` on first use."""
+    with registry_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name, **kwargs)
+
+        return breakers[name]
+
+
+def get_hedger(name):
+    global hedge_executor
+
+    with registry_lock:
+        if hedge_executor is None:
+            # separate from the search executor so hedges never wait behind the legs they duplicate
+            hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+        if name not in hedgers:
+            hedgers[name] = Hedger(name, hedge_executor)
+
+        return hedgers[name]
+
+
+def breaker_states():
+    with registry_lock:
+        return {name: breaker.state for name, breaker in breakers.items()}
@@ -0,0 +1,140 @@
+import os
+import threading
+from datetime import date
+
+
+HAIKU = "claude/3-haiku"
+SONNET = "claude/3-5-sonnet"
+
+# seconds a whole answer may take, retrieval included; Sonnet is skipped when it wouldn't fit
+ROUTER_LATENCY_BUDGET = float(os.getenv("ROUTER_LATENCY_BUDGET", "10"))
+# dollars of answer generation per day; once Sonnet would cross it, everything goes to Haiku
+ROUTER_DAILY_BUDGET = float(os.getenv("ROUTER_DAILY_BUDGET", "5.0"))
+# questions up to this many words count as short
+ROUTER_SHORT_QUESTION_WORDS = int(os.getenv("ROUTER_SHORT_QUESTION_WORDS", "12"))
+# retrieval_confidence from which a retrieval counts as confident; 0.75 needs the top document ranked
+# first by one search leg and at most second by the other. calibrate_router.py measures it on the ground truth
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.75"))
+
+# starting points for the latency and answer length estimates, before any answers are observed
+PRIOR_RESPONSE_TIME = {HAIKU: 2.0, SONNET: 6.0}
+PRIOR_COMPLETION_TOKENS = 300
+
+
+class ModelRouter:
+    """
+    Picks Haiku or Sonnet for questions asked in "auto" mode.
+
+    Short questions, and questions whose retrieval is confident (the kNN and keyword legs
+    both rank the top document at or near first place), go to Haiku. Others escalate to Sonnet unless its expected response
+    time would break the latency budget or its expected cost would take today's spend past
+    the daily budget. Response times and answer lengths are tracked as moving averages
+    from every observed answer, whichever way the model was chosen.
+    """
+
+    def __init__(self, cost, latency_budget=ROUTER_LATENCY_BUDGET, daily_budget=ROUTER_DAILY_BUDGET,
+                 short_question_words=ROUTER_SHORT_QUESTION_WORDS,
+                 confidence_threshold=ROUTER_CONFIDENCE_THRESHOLD, smoothing=0.2):
+        self.cost = cost
+        self.latency_budget = latency_budget
+        self.daily_budget = daily_budget
+        self.short_question_words = short_question_words
+        self.confidence_threshold = confidence_threshold
+        self.smoothing = smoothing
+
+        self.lock = threading.Lock()
+        self.response_times = dict(PRIOR_RESPONSE_TIME)
+        self.completion_tokens = {HAIKU: PRIOR_COMPLETION_TOKENS, SONNET: PRIOR_COMPLETION_TOKENS}
+        self.spend_day = date.today()
+        self.spend = 0.0
+        self.stats = {HAIKU: 0, SONNET: 0}
+
+    def choose(self, question, search_results, prompt_tokens, elapsed=0.0):
+        """Return (model_choice, decision), where decision records the inputs and the reason."""
+        confidence = retrieval_confidence(search_results)
+        question_words = len(question.split())
+
+        with self.lock:
+            self._roll_day()
+            expected_time = self.response_times[SONNET]
+            expected_cost = self.cost(SONNET, {
+                'prompt_tokens': prompt_tokens, 'completion_tokens': self.completion_tokens[SONNET],
+            })
+            spend = self.spend
+
+        if question_words <= self.short_question_words:
+            model_choice, reason = HAIKU, "short question"
+        elif confidence >= self.confidence_threshold:
+            model_choice, reason = HAIKU, "confident retrieval"
+        elif elapsed + expected_time > self.latency_budget:
+            model_choice, reason = HAIKU, "sonnet would exceed the latency budget"
+        elif spend + expected_cost > self.daily_budget:
+            model_choice, reason = HAIKU, "daily budget reached"
+        else:
+            model_choice, reason = SONNET, "long question with uncertain retrieval"
+
+        with self.lock:
+            self.stats[model_choice] += 1
+
+        return model_choice, {
+            'mode': "auto",
+            'model': model_choice,
+            'reason': reason,
+            'confidence': round(confidence, 4),
+            'question_words': question_words,
+            'elapsed': round(elapsed, 4),
+            'expected_sonnet_time': round(expected_time, 4),
+            'expected_sonnet_cost': round(expected_cost, 6),
+            'spend_today': round(spend, 6),
+        }
+
+    def observe(self, model_choice, response_time, completion_tokens, cost):
+        """Feed back a finished answer, whether or not it was routed."""
+        if model_choice not in self.response_times:
+            return
+
+        with self.lock:
+            self._roll_day()
+            self.response_times[model_choice] += self.smoothing * (response_time - self.response_times[model_choice])
+            self.completion_tokens[model_choice] += self.smoothing * (
+                completion_tokens - self.completion_tokens[model_choice]
+            )
+            self.spend += cost
+
+    def add_spend(self, cost):
+        """Count spend made elsewhere today, e.g. loaded from the database at startup."""
+        with self.lock:
+            self._roll_day()
+            self.spend += cost
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'routed': dict(self.stats),
+                'spend_today': self.spend,
+                'response_times': dict(self.response_times),
+            }
+
+    def _roll_day(self):
+        today = date.today()
+
+        if today != self.spend_day:
+            self.spend_day = today
+            self.spend = 0.0
+
+
+def retrieval_confidence(search_results):
+    """
+    How firmly the search legs agree on the top document: the mean of its reciprocal rank
+    in the kNN and keyword legs, counting 0 for a leg that didn't return it.
+
+    1.0 means both legs ranked it first and 0.75 first and second; a document only one leg
+    found scores at most 0.5. The fused RRF score can't tell these apart, as with k=60 any
+    document in both top-10 lists scores within 13% of the maximum.
+    """
+    if not search_results:
+        return 0.0
+
+    top = search_results[0]
+
+    return sum(1 / top[leg] for leg in ('knn_rank', 'keyword_rank') if top.get(leg)) / 2
@@ -0,0 +1,171 @@
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+# serve Prometheus text on this port at /metrics; 0 disables the endpoint
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# or rewrite this file every METRICS_FILE_INTERVAL seconds, e.g. for node_exporter's textfile collector
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+# number of recent durations per stage the percentiles are computed over
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# stage name -> seconds for the request being handled in this context, or None outside a trace
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class StageMetrics:
+    """
+    Rolling per-stage durations plus lifetime counts and sums, rendered as Prometheus summaries,
+    and labelled event counters (hedges, circuit breaker trips, ...) rendered as counters.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+        self.sums = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.durations[stage].append(seconds)
+            self.counts[stage] += 1
+            self.sums[stage] += seconds
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] += amount
+
+    def percentiles(self):
+        with self.lock:
+            durations = {stage: np.array(values) for stage, values in self.durations.items() if values}
+
+        return {
+            stage: {quantile: float(np.quantile(values, quantile)) for quantile in QUANTILES}
+            for stage, values in durations.items()
+        }
+
+    def render(self):
+        percentiles = self.percentiles()
+
+        with self.lock:
+            counts = dict(self.counts)
+            sums = dict(self.sums)
+            counters = dict(self.counters)
+
+        lines = [
+            "# HELP rag_stage_seconds Time spent in each stage of the RAG pipeline.",
+            "# TYPE rag_stage_seconds summary",
+        ]
+
+        for stage in sorted(counts):
+            for quantile, value in percentiles.get(stage, {}).items():
+                lines.append(f'rag_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+
+            lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {sums[stage]:.6f}')
+            lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {counts[stage]}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = StageMetrics()
+
+
+@contextmanager
+def trace(stages=None):
+    """Collect the durations of spans run in this context into `stages` (a new dict by default)."""
+    if stages is None:
+        stages = {}
+
+    token = current_trace.set(stages)
+
+    try:
+        yield stages
+    finally:
+        current_trace.reset(token)
+
+
+def record(stage, seconds):
+    """Report a duration measured elsewhere, e.g. a search leg timed on another thread."""
+    stages = current_trace.get()
+
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+    metrics.observe(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start_time)
+
+
+def write_metrics_file(path):
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w") as f_out:
+        f_out.write(metrics.render())
+
+    os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_export(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    """Start the /metrics endpoint and/or the metrics file writer, as configured."""
+    if port:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Serving metrics on :{port}/metrics", flush=True)
+
+    if path:
+        def write_periodically():
+            while True:
+                try:
+                    write_metrics_file(path)
+                except OSError as e:
+                    print(f"Could not write metrics to {path}: {e}", flush=True)
+
+                time.sleep(interval)
+
+        threading.Thread(target=write_periodically, name="metrics-file", daemon=True).start()
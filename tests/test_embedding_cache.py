@@ -0,0 +1,52 @@
+import numpy as np
+
+from embedding_cache import QueryEmbeddingCache
+
+
+def encoder(value):
+    calls = []
+
+    def encode(query):
+        calls.append(query)
+        return np.full(4, value, dtype=np.float32)
+
+    return encode, calls
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    encode, _ = encoder(1.0)
+    QueryEmbeddingCache(encode, path=str(tmp_path), disk_size=8, dim=4, model="minilm", backend="torch").encode("q")
+
+    encode, calls = encoder(2.0)
+    restarted = QueryEmbeddingCache(encode, path=str(tmp_path), disk_size=8, dim=4, model="minilm", backend="torch")
+
+    assert restarted.encode("q")[0] == 1.0
+    assert calls == []
+
+
+def test_disk_tier_of_another_model_or_backend_is_discarded(tmp_path):
+    encode, _ = encoder(1.0)
+    QueryEmbeddingCache(encode, path=str(tmp_path), disk_size=8, dim=4, model="minilm", backend="torch").encode("q")
+
+    for model, backend in [("mpnet", "torch"), ("minilm", "onnx-int8")]:
+        encode, calls = encoder(2.0)
+        cache = QueryEmbeddingCache(encode, path=str(tmp_path), disk_size=8, dim=4, model=model, backend=backend)
+
+        assert cache.encode("q")[0] == 2.0
+        assert calls == ["q"]
+
+
+def test_rows_written_since_the_snapshot_are_replayed_from_the_log(tmp_path):
+    encode, _ = encoder(1.0)
+    cache = QueryEmbeddingCache(encode, path=str(tmp_path), disk_size=4, dim=4, model="minilm", backend="torch")
+
+    # six misses wrap the four rows; no flush, as after a crash
+    for i in range(6):
+        cache.encode(f"q{i}")
+
+    encode, calls = encoder(2.0)
+    restarted = QueryEmbeddingCache(encode, path=str(tmp_path), disk_size=4, dim=4, model="minilm", backend="torch")
+
+    assert [restarted.encode(f"q{i}")[0] for i in range(2, 6)] == [1.0] * 4
+    assert calls == []
+    assert restarted.encode("q0")[0] == 2.0
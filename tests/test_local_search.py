@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+from local_search import LocalIndex
+
+
+DOCUMENTS = [
+    {'id': "a", 'page_content': "Fork the repository and open a pull request."},
+    {'id': "b", 'page_content': "Ask in Slack when an issue is unclear."},
+]
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, contents, batch_size=64):
+        self.calls += 1
+        return np.random.default_rng(self.calls).normal(size=(len(contents), 8))
+
+
+def load(tmp_path, documents=DOCUMENTS, model="minilm", backend="torch"):
+    documents_path = tmp_path / "documents.json"
+    documents_path.write_text(json.dumps(documents))
+    encode = CountingEncoder()
+
+    LocalIndex.from_files(str(documents_path), encode, str(tmp_path / "vectors.npy"), model=model, backend=backend)
+
+    return encode.calls
+
+
+def test_saved_vectors_are_reused(tmp_path):
+    assert load(tmp_path) == 1
+    assert load(tmp_path) == 0
+
+
+def test_edited_documents_are_re_encoded(tmp_path):
+    load(tmp_path)
+    edited = [DOCUMENTS[0], {**DOCUMENTS[1], 'page_content': "Ask in Slack first."}]
+
+    assert load(tmp_path, documents=edited) == 1
+
+
+def test_another_model_or_backend_re_encodes(tmp_path):
+    load(tmp_path)
+
+    assert load(tmp_path, model="mpnet") == 1
+    assert load(tmp_path, model="mpnet", backend="onnx-int8") == 1
+    assert load(tmp_path, model="mpnet", backend="onnx-int8") == 0
+
+
+def test_vectors_without_a_sidecar_are_re_encoded(tmp_path):
+    load(tmp_path)
+    (tmp_path / "vectors.npy.json").unlink()
+
+    assert load(tmp_path) == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from router import HAIKU, SONNET, ModelRouter, retrieval_confidence
+
+
+LONG_QUESTION = "What should I do when the pull request I opened last week still has no reviewer assigned to it?"
+
+
+def result(knn_rank, keyword_rank):
+    return [{'id': "doc", 'knn_rank': knn_rank, 'keyword_rank': keyword_rank}]
+
+
+@pytest.mark.parametrize("knn_rank, keyword_rank, confidence", [
+    (1, 1, 1.0),
+    (1, 2, 0.75),
+    (2, 1, 0.75),
+    (3, 3, 1 / 3),
+    (1, None, 0.5),
+    (None, 1, 0.5),
+])
+def test_confidence_follows_the_leg_ranks_of_the_top_document(knn_rank, keyword_rank, confidence):
+    assert retrieval_confidence(result(knn_rank, keyword_rank)) == pytest.approx(confidence)
+
+
+def test_no_results_are_not_confident():
+    assert retrieval_confidence([]) == 0.0
+
+
+def test_top_document_in_both_lists_is_not_enough():
+    # ranks 3 and 4 fuse to an RRF score 96% of the maximum, which used to count as confident
+    router = ModelRouter(lambda model, tokens: 0.0)
+
+    model_choice, decision = router.choose(LONG_QUESTION, result(3, 4), prompt_tokens=1000)
+
+    assert model_choice == SONNET
+    assert decision['reason'] == "long question with uncertain retrieval"
+
+
+def test_agreeing_legs_route_to_haiku():
+    router = ModelRouter(lambda model, tokens: 0.0)
+
+    model_choice, decision = router.choose(LONG_QUESTION, result(1, 1), prompt_tokens=1000)
+
+    assert model_choice == HAIKU
+    assert decision['reason'] == "confident retrieval"
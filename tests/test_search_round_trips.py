@@ -0,0 +1,155 @@
+import pytest
+
+import assistant
+import resilience
+
+
+DOCUMENTS = {
+    f"doc-{i}": {'id': f"doc-{i}", 'page_content': f"How to contribute, part {i}.", 'header_1': "Contributing"}
+    for i in range(10)
+}
+
+
+class CountingElasticsearch:
+    """Stub client that answers every search with the same hits and counts round trips per method."""
+
+    def __init__(self, include_source=True):
+        self.include_source = include_source
+        self.calls = {'search': 0, 'msearch': 0, 'mget': 0, 'get': 0}
+        self.bodies = []
+
+    def options(self, **kwargs):
+        return self
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def hits(self, body, reverse=False):
+        self.bodies.append(body)
+        ids = sorted(DOCUMENTS, reverse=reverse)
+
+        return [self.hit(doc_id, body.get('_source')) for doc_id in ids[:body.get('size', 10)]]
+
+    def hit(self, doc_id, source_fields):
+        hit = {'_id': doc_id}
+
+        if self.include_source:
+            hit['_source'] = {key: DOCUMENTS[doc_id][key] for key in source_fields or DOCUMENTS[doc_id]}
+
+        return hit
+
+    def search(self, index=None, body=None):
+        self.calls['search'] += 1
+
+        return {'took': 1, 'hits': {'hits': self.hits(body, reverse='knn' in body)}}
+
+    def msearch(self, searches):
+        self.calls['msearch'] += 1
+
+        return {'responses': [
+            {'took': 1, 'hits': {'hits': self.hits(body, reverse='knn' in body)}} for body in searches[1::2]
+        ]}
+
+    def mget(self, index=None, ids=(), source=None):
+        self.calls['mget'] += 1
+
+        return {'docs': [
+            {'_id': doc_id, 'found': True, '_source': {key: DOCUMENTS[doc_id][key] for key in source}}
+            for doc_id in ids
+        ]}
+
+    def get(self, index=None, id=None):
+        self.calls['get'] += 1
+
+        return {'_id': id, 'found': True, '_source': DOCUMENTS[id]}
+
+
+@pytest.fixture
+def es_client():
+    def install(include_source=True):
+        client = CountingElasticsearch(include_source)
+        assistant.set_singleton('es_client', client)
+        return client
+
+    previous = assistant.singletons.get('es_client')
+
+    # breakers and hedgers are process-wide; start every test from closed breakers and no latency history
+    resilience.breakers.clear()
+    resilience.hedgers.clear()
+
+    yield install
+
+    assistant.set_singleton('es_client', previous)
+
+
+def search(mode):
+    return assistant.elastic_search_hybrid_rrf('page_content_vector', "how do I contribute?", [0.1] * 384, mode=mode)
+
+
+@pytest.mark.parametrize("mode, expected_round_trips", [("sequential", 2), ("concurrent", 2), ("msearch", 1)])
+def test_sources_come_from_the_hits(es_client, mode, expected_round_trips):
+    client = es_client()
+
+    results = search(mode)
+
+    assert len(results) == 5
+    assert client.round_trips == expected_round_trips
+    assert client.calls['get'] == 0 and client.calls['mget'] == 0
+
+
+def test_missing_sources_are_fetched_in_one_mget(es_client):
+    client = es_client(include_source=False)
+
+    results = search("msearch")
+
+    assert len(results) == 5
+    assert client.calls == {'search': 0, 'msearch': 1, 'mget': 1, 'get': 0}
+
+
+def test_round_trips_per_question_drop_from_seven(es_client):
+    # before: kNN search, keyword search and one get per top-5 id
+    client = es_client()
+
+    search("sequential")
+
+    assert client.round_trips <= 2 < 7
+
+
+def test_source_is_limited_to_the_prompt_fields(es_client):
+    client = es_client()
+
+    results = search("sequential")
+
+    assert all(body['_source'] == assistant.SOURCE_FIELDS for body in client.bodies)
+    assert all(set(doc) == set(assistant.SOURCE_FIELDS) | {'rrf_score', 'knn_rank', 'keyword_rank'} for doc in results)
+
+
+def test_msearch_leaves_out_a_leg_whose_breaker_is_open(es_client):
+    client = es_client()
+    knn_breaker = resilience.get_breaker("es.knn")
+
+    for _ in range(knn_breaker.failure_threshold):
+        knn_breaker.record_failure()
+
+    results = search("msearch")
+
+    assert len(results) == 5
+    assert client.calls['msearch'] == 1
+    assert all('knn' not in body for body in client.bodies)
+    assert all(doc['knn_rank'] is None for doc in results)
+
+
+def test_msearch_with_both_breakers_open_sends_nothing(es_client):
+    client = es_client()
+
+    for leg in ("knn", "keyword"):
+        breaker = resilience.get_breaker(f"es.{leg}")
+
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+    with pytest.raises(resilience.CircuitOpenError):
+        search("msearch")
+
+    assert client.round_trips == 0